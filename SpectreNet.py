@@ -1,2068 +1,2625 @@
-from flask import Flask, request, jsonify # pyright: ignore[reportMissingImports]
-import time
-import json
-import random
-import re
-import uuid
-from collections import deque
-from datetime import datetime
-from zoneinfo import ZoneInfo
-import logging
-
-
-app = Flask(__name__)
-
-# Make sure Python's root logging is at least INFO
-logging.basicConfig(level=logging.INFO)
-
-# Make sure Flask's logger is also INFO
-app.logger.setLevel(logging.INFO)
-
-app.logger.info("🔥 ATC server starting up, custom logging should be visible")
-
-# Load airports and triggers from JSON
-with open("airports.json", "r") as f:
-    airport_data = json.load(f)
-
-with open("atc_config.json", "r") as f:
-    atc_config = json.load(f)
-
-with open("channels.json") as f:
-    CHANNELS_CONFIG = json.load(f)["channels"]
-
-with open("weather.json") as f:
-    WEATHER_CONFIG = json.load(f)
-
-CHANNELS_BY_FREQ = {}
-for channel_id, cfg in CHANNELS_CONFIG.items():
-    freq = cfg["frequency"]
-
-    tx_policy = cfg.get("tx_policy", {})
-    if tx_policy.get("mode") == "whitelist_uuid":
-        tx_policy["allowed_uuids_set"] = set(tx_policy.get("allowed_uuids", []))
-
-    sender = cfg.get("sender") or cfg.get("name") or channel_id
-
-    CHANNELS_BY_FREQ[freq] = {
-        "id": channel_id,
-        **cfg,
-        "sender": sender,
-        "tx_policy": tx_policy,
-    }
-
-ATC_TOWERS = airport_data["airports"]
-ATC_RESPONSES = atc_config["responses"]
-TRIGGER_PHRASES = atc_config["trigger_phrases"]
-HANDOFF_MESSAGES = atc_config.get("handoff_messages", {})
-ROLE_MAP = atc_config.get("role_map", {})
-REDIRECT_MESSAGES = atc_config.get("redirects", {})
-UNKNOWN_MESSAGES = atc_config.get("unknown", {})
-AUTO_CLEAR_RESPONSES = atc_config.get("auto_clear", {})
-SEQUENCING = atc_config.get("sequencing", {})
-OCCUPANCY = SEQUENCING.get("occupancy_seconds", {})
-HOLD_MESSAGES = SEQUENCING.get("holds", {})
-INVALID_RUNWAY_MESSAGES = atc_config.get("invalid_runway", {})
-EMERGENCY_TRIGGERS = atc_config.get("emergency_triggers", {})
-POSSIBLE_EMERGENCY_TRIGGERS = EMERGENCY_TRIGGERS.get("possible_emergency_triggers", [])
-
-GROUND_TRIGGER_PHRASES = tuple(TRIGGER_PHRASES.get("taxi", []) + TRIGGER_PHRASES.get("startup", []))
-TOWER_TRIGGER_PHRASES = tuple(TRIGGER_PHRASES.get("takeoff", []) + TRIGGER_PHRASES.get("landing", []))
-STARTUP_TRIGGER_PHRASES = tuple(TRIGGER_PHRASES.get("startup", []))
-
-# Combine and normalize all emergency trigger phrases once at startup
-_EMERGENCY_TRIGGER_LIST = (
-    EMERGENCY_TRIGGERS.get("mayday", [])
-    + EMERGENCY_TRIGGERS.get("pan", [])
-    + EMERGENCY_TRIGGERS.get("generic", [])
-)
-EMERGENCY_TRIGGER_PHRASES = tuple(p.lower() for p in _EMERGENCY_TRIGGER_LIST)
-
-FLIGHT_PLAN_CONFIG = atc_config.get("flight_plan", {})
-FP_TRIGGERS = [t.lower() for t in FLIGHT_PLAN_CONFIG.get("triggers", [])]
-FP_RESPONSES = FLIGHT_PLAN_CONFIG.get("responses", [])
-
-FP_HANDOFF_CONFIG = atc_config.get("flight_plan_departure_handoff", {})
-FP_HANDOFF_RESPONSES = FP_HANDOFF_CONFIG.get("responses", [])
-FP_HANDOFF_CHANCE = float(FP_HANDOFF_CONFIG.get("chance", 0.0))
-
-ZONE_DEFAULTS = WEATHER_CONFIG.get("defaults", {})
-ZONE_CONFIGS = WEATHER_CONFIG.get("zones", {})
-CONDITION_CONFIGS = WEATHER_CONFIG.get("conditions", {})
-WEATHER_ZONES: dict[str, list[str]] = {}
-WEATHER_STATE: dict[str, dict] = {}
-
-SERVER_INSTANCE_ID = str(uuid.uuid4())
-
-# Per-frequency storage
-channels = {}
-
-RUNWAY_STATE = {}
-RUNWAY_END_TO_PHYSICAL: dict[str, dict[str, str]] = {}   # ICAO -> { "27L": "RWY_L", ... }
-VALID_ENDS_BY_ACTION: dict[str, dict[str, set[str]]] = {}
-
-HELIPADS_BY_AIRPORT: dict[str, dict[str, dict]] = {}     # ICAO -> { "H1": {...}, "HOSP": {...} }
-HELIPAD_OCCUPANCY: dict[str, dict[str, int]] = {}        # ICAO -> { "H1": 0, "HOSP": 0, ... }
-
-
-# Airport+callsign -> timestamp (or just flag) for active flight plans
-ACTIVE_FLIGHT_PLANS: dict[tuple[str, str], float] = {}
-# (airport_code, CALLSIGN) -> {"origin": ..., "destination": ...}
-FLIGHT_PLAN_ROUTES: dict[tuple[str, str], dict] = {}
-FLIGHT_PLAN_TTL_SECONDS = 60 * 60
-
-ACTIVE_EMERGENCIES: dict[tuple[str, str], dict] = {}
-EMERGENCY_TTL_SECONDS = 5 * 60  # auto-expire after 5 minutes
-
-DEFAULT_FREQUENCY = 16
-
-RUNWAY_RE = re.compile(r"\b(?:runway|rwy)\s*([0-3]?\d)\s*([LRC])?\b", re.IGNORECASE)
-PILOT_ASSIGNED_RUNWAY = {}
-PILOT_ASSIGNED_HELIPAD: dict[tuple[str, str], str] = {}  # (ICAO, CALLSIGN) -> helipad id
-PILOT_HELIPAD_LAST_ACTIVITY: dict[tuple[str, str], float] = {}
-HELIPAD_TTL_SECONDS = 1800  # e.g. 30 minutes; tune as you like
-
-
-ROUTE_PATTERN = re.compile(
-    r"\b([A-Z0-9]{3,4})\s*(?:>|to|-|–)\s*([A-Z0-9]{3,4})\b",
-    re.IGNORECASE
-)
-DEST_ONLY_PATTERN = re.compile(
-    r"\bto\s+([A-Z0-9]{3,4})\b",
-    re.IGNORECASE,
-)
-
-MAX_MESSAGES = 100  # keep list small
-FREQUENCY_EXPIRE_SECONDS = 30 * 60  # 30 minutes
-
-SL_DAY_SECONDS = 4 * 60 * 60  # 4 hours = 14,400 seconds
-
-def get_sl_cycle_fraction(now=None):
-    """
-    Returns a float from 0.0–1.0 representing
-    where we are in SL's 4-hour day cycle.
-    """
-    if now is None:
-        now = time.time()
-
-    return (now % SL_DAY_SECONDS) / SL_DAY_SECONDS
-
-def get_sl_day_window(now=None):
-    frac = get_sl_cycle_fraction(now)
-
-    if frac < 0.25:
-        return "MORNING"
-    elif frac < 0.50:
-        return "AFTERNOON"
-    elif frac < 0.75:
-        return "EVENING"
-    else:
-        return "NIGHT"
-
-def get_slt_now():
-    return datetime.now(ZoneInfo("America/Los_Angeles"))
-
-def get_slt_hour():
-    return get_slt_now().hour
-
-def get_channel(freq):
-    now = time.time()
-
-    if freq not in channels:
-        channels[freq] = {
-            "next_id": 1,
-            "messages": deque(maxlen=MAX_MESSAGES),
-            "last_active": now
-        }
-
-    channels[freq]["last_active"] = now
-    return channels[freq]
-
-def can_transmit_on_frequency(freq, sender_uuid):
-    channel = CHANNELS_BY_FREQ.get(freq)
-    if not channel:
-        # Not a dedicated channel – treat as normal ATC / regular freq
-        return True
-
-    policy = channel.get("tx_policy", {})
-    mode = policy.get("mode", "open")
-
-    if mode == "open":
-        return True
-
-    if mode == "server_only":
-        # Only internal/server-injected messages allowed
-        return False
-
-    if mode == "whitelist_uuid":
-        allowed = policy.get("allowed_uuids_set")
-        if allowed is None:
-            # Safety fallback if config was loaded before precompute
-            allowed = set(policy.get("allowed_uuids", []))
-            policy["allowed_uuids_set"] = allowed
-        return sender_uuid in allowed
-
-    # Future: other modes, but default to no if unknown
-    return False
-
-# -------------------------------------------------------------------
-# Helicopter detection (JSON-driven)
-# -------------------------------------------------------------------
-def is_helicopter_request(request_text: str, callsign: str) -> bool:
-    text = (request_text or "").lower()
-    cs = (callsign or "").lower()
-
-    heli_cfg = TRIGGER_PHRASES.get("helicopter", {})
-
-    if isinstance(heli_cfg, list):
-        for kw in heli_cfg:
-            if isinstance(kw, str) and kw.lower() in text:
-                return True
-
-    # Optional callsign-based detection
-    if cs.startswith(("heli", "helo", "h-")):
-        return True
-
-    return False
-
-def choose_helicopter_response(airport_code: str, action: str, callsign: str, helipad: str | None = None) -> str:
-    airport_cfg = ATC_TOWERS.get(airport_code, {})
-    resp_cfg = ATC_RESPONSES.get("responses", {})
-
-    key = f"helicopter_{action}"
-    candidates = ATC_RESPONSES.get(key, [])
-
-    def _format(template: str) -> str:
-        return template.format(
-            CALLSIGN=callsign,
-            AIRPORT=airport_code,
-            HELIPAD=helipad or "",
-        )
-
-    if candidates:
-        template = random.choice(candidates)
-        return _format(template)
-
-    # Fallback: generic non-runway phrasing
-    generic_key = f"{action}"
-    fallback = ATC_RESPONSES.get(generic_key, [])
-
-    if fallback:
-        template = random.choice(fallback)
-        return _format(template)
-
-    # Absolute fallback (never mentions runway)
-    if action == "takeoff":
-        return f"{callsign}, cleared for departure."
-    if action == "landing":
-        return f"{callsign}, cleared to land."
-
-    return None
-
-
-#------------------------------------
-# EMERGENCY HELPERS
-#------------------------------------
-EMERGENCY_TYPE_NONE = "none"
-EMERGENCY_TYPE_MAYDAY = "mayday"
-EMERGENCY_TYPE_PAN = "pan"
-EMERGENCY_TYPE_GENERIC = "generic"
-
-def _contains_phrase(text: str, phrase: str) -> bool:
-    """
-    Case-insensitive substring match with whitespace normalization.
-    """
-    return phrase in text
-
-
-def detect_emergency_type(text: str) -> str:
-    """
-    Detect emergency type based purely on JSON-defined trigger phrases.
-    Priority order:
-      MAYDAY > PAN > GENERIC
-    """
-    if not text:
-        return EMERGENCY_TYPE_NONE
-
-    t = text.lower()
-
-    # MAYDAY has highest priority
-    for phrase in EMERGENCY_TRIGGERS.get("mayday", []):
-        if _contains_phrase(t, phrase.lower()):
-            return EMERGENCY_TYPE_MAYDAY
-
-    # PAN PAN next
-    for phrase in EMERGENCY_TRIGGERS.get("pan", []):
-        if _contains_phrase(t, phrase.lower()):
-            return EMERGENCY_TYPE_PAN
-
-    # Generic emergency last
-    for phrase in EMERGENCY_TRIGGERS.get("generic", []):
-        if _contains_phrase(t, phrase.lower()):
-            return EMERGENCY_TYPE_GENERIC
-
-    return EMERGENCY_TYPE_NONE
-
-def sounds_like_possible_emergency(text: str) -> bool:
-    if not text:
-        return False
-
-    t = text.lower()
-    for phrase in POSSIBLE_EMERGENCY_TRIGGERS:
-        if phrase.lower() in t:
-            return True
-    return False
-
-
-#------------------------------------
-# RUNWAY HELPERS
-#------------------------------------
-def build_runway_indexes():
-    for icao, tower in ATC_TOWERS.items():
-        icao_u = icao.upper()
-        tower["_icao"] = icao_u  # tag config so helpers can find ICAO quickly
-
-        # Map runway-end -> physical runway id
-        end_map: dict[str, str] = {}
-        for r in tower.get("runways", []):
-            phys = (r.get("physical_id") or r.get("id") or "").strip()
-            if not phys:
-                continue
-
-            for end in (r.get("landing_ends") or []):
-                end_map[end.upper()] = phys
-            for end in (r.get("takeoff_ends") or []):
-                end_map[end.upper()] = phys
-
-        RUNWAY_END_TO_PHYSICAL[icao_u] = end_map
-        VALID_ENDS_BY_ACTION[icao_u] = {}  # filled lazily by runway_ends_for_action
-
-def build_helipad_indexes():
-    """
-    Build ICAO -> helipad config + occupancy maps from airport data.
-    """
-    HELIPADS_BY_AIRPORT.clear()
-    HELIPAD_OCCUPANCY.clear()
-
-    for icao, tower in ATC_TOWERS.items():
-        icao_u = icao.upper()
-        pads = tower.get("helipads", [])
-        if not pads:
-            continue
-
-        pad_map: dict[str, dict] = {}
-        occ_map: dict[str, int] = {}
-
-        for pad in pads:
-            pid = (pad.get("id") or "").upper().strip()
-            if not pid:
-                continue
-
-            pad_map[pid] = pad
-            occ_map[pid] = 0  # start empty
-
-        if pad_map:
-            HELIPADS_BY_AIRPORT[icao_u] = pad_map
-            HELIPAD_OCCUPANCY[icao_u] = occ_map
-
-build_runway_indexes()
-build_helipad_indexes()
-
-def parse_requested_runway(request_text: str) -> str | None:
-    m = RUNWAY_RE.search(request_text or "")
-    if not m:
-        return None
-    num = int(m.group(1))
-    if num < 1 or num > 36:
-        return None
-    side = (m.group(2) or "").upper()
-    return f"{num:02d}{side}"
-
-def find_requested_helipad(airport_code: str, request_text: str) -> str | None:
-    """
-    Look for a helipad id (e.g. 'H1', 'HOSP') in the request text
-    that matches any configured helipad for this airport.
-    """
-    pads = HELIPADS_BY_AIRPORT.get(airport_code, {})
-    if not pads or not request_text:
-        return None
-
-    t = request_text.upper()
-    for pid in pads.keys():
-        if pid in t:
-            return pid
-
-    return None
-
-def assign_helipad(airport_code: str, requested_id: str | None, action: str):
-    """
-    Decide which helipad a helicopter should use at this airport.
-
-    For LANDING:
-      - Respect occupancy.
-      - Multi-pad: requested full -> divert to another; if all full -> "hold".
-      - Single-pad: if full -> "anywhere" (land anywhere on the field).
-
-    For TAKEOFF:
-      - Ignore occupancy. Never returns "hold" or "anywhere".
-      - Use requested pad if valid, otherwise first configured pad.
-
-    Returns:
-      (assigned_helipad_id, mode)
-
-    mode:
-      - None        -> normal helipad assignment
-      - "anywhere"  -> (LANDING only) single-pad, full
-      - "hold"      -> (LANDING only) multi-pad, all full
-    """
-    pad_map = HELIPADS_BY_AIRPORT.get(airport_code, {})
-    if not pad_map:
-        return None, None  # no helipads here
-
-    occ_map = HELIPAD_OCCUPANCY.setdefault(airport_code, {})
-    pad_ids = list(pad_map.keys())
-    pad_count = len(pad_ids)
-
-    # make sure keys exist in occ_map
-    for pid in pad_ids:
-        occ_map.setdefault(pid, 0)
-
-    requested_id = (requested_id or "").upper() or None
-
-    # ----------------------------------------
-    # TAKEOFF: do NOT enforce occupancy
-    # ----------------------------------------
-    if action == "takeoff":
-        # prefer requested pad if it exists
-        if requested_id and requested_id in pad_map:
-            return requested_id, None
-
-        # otherwise just use first pad
-        return pad_ids[0], None
-
-    # ----------------------------------------
-    # LANDING: enforce occupancy/diversion rules
-    # ----------------------------------------
-
-    def has_space(pid: str) -> bool:
-        pad_cfg = pad_map[pid]
-        max_sim = int(pad_cfg.get("max_simultaneous", 1))
-        current = int(occ_map.get(pid, 0))
-        return current < max_sim
-
-    # 1) Requested specific pad
-    if requested_id and requested_id in pad_map:
-        if has_space(requested_id):
-            return requested_id, None
-
-        if pad_count == 1:
-            # single pad, full -> land anywhere
-            return None, "anywhere"
-
-        # multi-pad: try to divert
-        for pid in pad_ids:
-            if pid == requested_id:
-                continue
-            if has_space(pid):
-                return pid, None
-
-        # all pads full
-        return None, "hold"
-
-    # 2) No specific pad requested: pick any with space
-    available = [pid for pid in pad_ids if has_space(pid)]
-    if available:
-        return available[0], None
-
-    # 3) None have space
-    if pad_count == 1:
-        return None, "anywhere"
-
-    return None, "hold"
-
-
-def runway_ends_for_action(tower: dict, action: str) -> set[str]:
-    """
-    Return valid runway END strings for the given action based on your schema.
-    Caches per-airport per-action for speed.
-    """
-    icao = (tower.get("_icao") or "").upper()
-    if icao:
-        cached = VALID_ENDS_BY_ACTION.get(icao, {}).get(action)
-        if cached is not None:
-            return cached
-
-    ends: set[str] = set()
-
-    if action == "landing":
-        if tower.get("landings"):
-            ends.update(x.upper() for x in tower["landings"])
-        else:
-            for r in tower.get("runways", []):
-                ends.update(x.upper() for x in r.get("landing_ends", []))
-
-    elif action == "takeoff":
-        if tower.get("departures"):
-            ends.update(x.upper() for x in tower["departures"])
-        else:
-            for r in tower.get("runways", []):
-                ends.update(x.upper() for x in r.get("takeoff_ends", []))
-
-    elif action == "taxi":
-        ends = runway_ends_for_action(tower, "takeoff")
-
-    # Cache result
-    if icao:
-        VALID_ENDS_BY_ACTION.setdefault(icao, {})[action] = ends
-
-    return ends
-
-def physical_id_for_runway_end(tower: dict, runway_end: str) -> str | None:
-    """
-    Map runway end (e.g. '27L') to runway physical_id using cached lookup.
-    """
-    runway_end = (runway_end or "").upper()
-    icao = (tower.get("_icao") or "").upper()
-
-    if icao:
-        hit = RUNWAY_END_TO_PHYSICAL.get(icao, {}).get(runway_end)
-        if hit:
-            return hit
-
-    # Fallback (in case runways are missing or caches not built)
-    for r in tower.get("runways", []):
-        if runway_end in [x.upper() for x in r.get("landing_ends", [])]:
-            return r.get("physical_id") or r.get("id")
-        if runway_end in [x.upper() for x in r.get("takeoff_ends", [])]:
-            return r.get("physical_id") or r.get("id")
-    return None
-
-def get_current_window(config, now=None):
-    if now is None:
-        now = get_slt_now()  # <-- SLT here
-
-    hour = now.hour
-    windows = config.get("time_windows", {})
-
-    for name, window in windows.items():
-        start = window["start_hour"]
-        end = window["end_hour"]
-
-        if start < end:
-            if start <= hour < end:
-                return name
-        else:
-            # Wraps past midnight (e.g. 21 → 05)
-            if hour >= start or hour < end:
-                return name
-
-    return "AFTERNOON"  # safe fallback
-
-def init_weather_zones():
-    for icao, ap in ATC_TOWERS.items():
-        zone_name = ap.get("weather_zone") or icao.upper()
-        ap["weather_zone"] = zone_name  # ensure it's set
-
-        WEATHER_ZONES.setdefault(zone_name, []).append(icao)
-
-        if zone_name not in WEATHER_STATE:
-            WEATHER_STATE[zone_name] = make_initial_weather_state(zone_name)
-
-def get_zone_defaults(zone_name: str) -> dict:
-    zone_cfg = ZONE_CONFIGS.get(zone_name, {})
-    cfg = ZONE_DEFAULTS.copy()
-    cfg.update(zone_cfg)
-    return cfg
-
-def make_initial_weather_state(zone_name: str) -> dict:
-    cfg = get_zone_defaults(zone_name)
-
-    base_temp = cfg.get("base_temp", 20)
-    temp_var  = cfg.get("temp_variation", 5)
-    wind_min  = cfg.get("wind_min", 0)
-    wind_max  = cfg.get("wind_max", 20)
-    qnh_mean  = cfg.get("qnh_mean", 1015)
-    qnh_var   = cfg.get("qnh_variation", 8)
-    favored   = cfg.get("favored_conditions", ["CLEAR", "FEW", "BKN"])
-
-    condition = random.choice(favored)
-
-    return {
-        "condition": condition,
-        "wind_dir": random.randint(0, 359),
-        "wind_speed": random.randint(wind_min, wind_max),
-        "visibility": CONDITION_CONFIGS.get(condition, {}).get("visibility", "GOOD"),
-        "style": CONDITION_CONFIGS.get(condition, {}).get("style", "VFR"),
-        "temp": base_temp + random.randint(-temp_var, temp_var),
-        "qnh": qnh_mean + random.randint(-qnh_var, qnh_var),
-        "last_update": time.time(),
-        "zone": zone_name
-    }
-
-def step_value(value, step, min_v, max_v):
-    return max(min_v, min(max_v, value + random.randint(-step, step)))
-
-def pick_next_condition(config, zone_name, current_condition=None, now=None):
-    zones = config["zones"]
-    cond_def = config["conditions"]
-
-    zone = zones[zone_name]
-    time_window = get_sl_day_window()  # e.g. "AFTERNOON"
-
-    # 1) Decide candidate conditions
-    if current_condition:
-        # Use transitions from the current condition
-        base = cond_def[current_condition]
-        transitions = base.get("transition", [])
-
-        # Include "stay the same" as an implicit option
-        candidates = [(current_condition, 1.0)]
-        for t in transitions:
-            candidates.append((t["to"], t["chance"]))
-    else:
-        # No current condition: pick from the zone's favored list
-        conds = zone.get("favored_conditions") or config["defaults"]["favored_conditions"]
-        candidates = [(c, 1.0) for c in conds]
-
-    # 2) Apply time-of-day bias
-    weighted = []
-    for name, base_chance in candidates:
-        cdef = cond_def.get(name, {})
-        time_bias = 1.0
-
-        if time_window:
-            bias_map = cdef.get("time_bias", {})
-            time_bias = bias_map.get(time_window, 1.0)
-
-        weight = base_chance * time_bias
-        if weight > 0:
-            weighted.append((name, weight))
-
-    # Safety: if everything got zero’d somehow
-    if not weighted:
-        # fallback to current_condition or CLEAR
-        return current_condition or "CLEAR"
-
-    # 3) Random choice using weights
-    total = sum(w for _, w in weighted)
-    r = random.random() * total
-    upto = 0.0
-
-    for name, w in weighted:
-        upto += w
-        if r <= upto:
-            return name
-
-    # Fallback
-    return weighted[-1][0]
-
-def update_zone_weather(state: dict):
-    zone_name = state["zone"]
-    cfg = get_zone_defaults(zone_name)
-
-    wind_min = cfg.get("wind_min", 0)
-    wind_max = cfg.get("wind_max", 20)
-    base_temp = cfg.get("base_temp", 20)
-    temp_var  = cfg.get("temp_variation", 5)
-    qnh_mean  = cfg.get("qnh_mean", 1015)
-    qnh_var   = cfg.get("qnh_variation", 8)
-
-    # Wind random walk within zone range
-    state["wind_dir"] = (state["wind_dir"] + random.randint(-10, 10)) % 360
-    state["wind_speed"] = step_value(state["wind_speed"], 2, wind_min, wind_max)
-
-    # Temp drifts toward base_temp-ish area
-    state["temp"] = step_value(state["temp"], 1, base_temp - temp_var, base_temp + temp_var)
-
-    # Pressure wiggle
-    state["qnh"] = step_value(state["qnh"], 1, qnh_mean - qnh_var, qnh_mean + qnh_var)
-
-    # Condition transition using config
-    current_cond = state.get("condition")
-    new_cond = pick_next_condition(WEATHER_CONFIG, zone_name, current_cond)
-    state["condition"] = new_cond
-
-    cond_cfg = CONDITION_CONFIGS.get(new_cond, {})
-    state["visibility"] = cond_cfg.get("visibility", state.get("visibility", "GOOD"))
-    state["style"] = cond_cfg.get("style", state.get("style", "VFR"))
-
-    state["last_update"] = time.time()
-
-def get_weather_for_airport(icao: str) -> dict | None:
-    """
-    Return current weather state for an airport's zone.
-    Uses ATC_TOWERS as the source of truth (flat dict: ICAO -> config).
-    Lazily initializes zone weather if missing.
-    """
-    icao = icao.upper()
-
-    ap = ATC_TOWERS.get(icao)
-    if not ap:
-        # Truly unknown airport
-        return None
-
-    # Get zone from config or default to ICAO
-    zone = ap.get("weather_zone")
-    if not zone:
-        zone = icao
-        ap["weather_zone"] = zone
-
-    # Lazy init weather state
-    if zone not in WEATHER_STATE:
-        WEATHER_STATE[zone] = make_initial_weather_state(zone)
-
-    state = WEATHER_STATE[zone]
-    state["zone"] = zone
-    return state
-
-def format_metar_from_state(icao: str, state: dict | None) -> str | None:
-    """
-    Build a pseudo-METAR string from your simulated weather state.
-
-    Uses keys:
-      condition (e.g. "FEW")
-      visibility ("GOOD", "MODERATE", "POOR"...)
-      style ("VFR", "IFR"...)
-      wind_dir (degrees)
-      wind_speed (knots)
-      temp (°C)
-      qnh (hPa)
-    """
-    if not state:
-        return None
-
-    # Time: DDHHMMZ in UTC
-    now = datetime.now()
-    time_str = now.strftime("%d%H%MZ")
-
-    # Wind
-    try:
-        wind_dir = int(state.get("wind_dir") or 0)
-    except (TypeError, ValueError):
-        wind_dir = 0
-
-    try:
-        wind_speed = int(state.get("wind_speed") or 0)
-    except (TypeError, ValueError):
-        wind_speed = 0
-
-    if wind_speed <= 1:
-        wind_str = "00000KT"
-    else:
-        wind_str = f"{wind_dir:03d}{wind_speed:02d}KT"
-
-    # Visibility buckets from your "visibility" string
-    vis_code = (state.get("visibility") or "").upper()
-    if vis_code == "GOOD":
-        vis_str = "10SM"
-    elif vis_code in ("MODERATE", "MOD"):
-        vis_str = "6SM"
-    elif vis_code in ("POOR", "LOW"):
-        vis_str = "3SM"
-    else:
-        vis_str = "10SM"
-
-    # Clouds from your "condition" string
-    cond = (state.get("condition") or "").upper()
-
-    wx_str = ""
-    clouds_str = ""
-
-    if cond == "CLEAR":
-        clouds_str = "SKC"
-
-    elif cond == "FEW":
-        clouds_str = "FEW020"
-
-    elif cond == "BKN":
-        clouds_str = "BKN030"
-
-    elif cond == "OVC":
-        clouds_str = "OVC015"
-
-    elif cond == "RAIN":
-        wx_str = "RA"
-        clouds_str = "BKN025"
-
-    elif cond == "STORM":
-        wx_str = "TSRA"
-        clouds_str = "BKN030CB"
-
-    elif cond == "MONSOON":
-        wx_str = "+RA"
-        clouds_str = "OVC020"
-
-    elif cond == "SNOW":
-        wx_str = "SN"
-        clouds_str = "OVC020"
-
-    elif cond == "MIST":
-        wx_str = "BR"
-        clouds_str = "FEW005"
-
-    elif cond == "FOG":
-        wx_str = "FG"
-        clouds_str = "OVC003"
-
-    elif cond == "HAZE":
-        wx_str = "HZ"
-        clouds_str = "NSC"
-
-    elif cond == "DUST":
-        wx_str = "DU"
-        clouds_str = "NSC"
-
-    else:
-        clouds_str = "NSC"
-
-
-    # Temperature / (fake) dewpoint
-    try:
-        temp = int(state.get("temp"))
-    except (TypeError, ValueError):
-        temp = 18  # safe default
-
-    dew = temp - 6  # simple fake dewpoint; adjust if you like
-
-    def fmt_t(t: int) -> str:
-        if t < 0:
-            return f"M{abs(t):02d}"
-        return f"{t:02d}"
-
-    temp_str = fmt_t(temp)
-    dew_str = fmt_t(int(dew))
-
-    # QNH
-    try:
-        qnh = int(state.get("qnh"))
-    except (TypeError, ValueError):
-        qnh = 1015
-    qnh_str = f"Q{qnh:04d}"
-
-    # Flight rules
-    style = (state.get("style") or "").upper()
-    if style not in ("VFR", "MVFR", "IFR", "LIFR"):
-        style = "VFR"
-
-    # Final body: ICAO DDHHMMZ ...
-    parts = [icao, time_str, wind_str, vis_str]
-
-    # Insert weather group if present (RA/TSRA/FG/etc.)
-    if wx_str:
-        parts.append(wx_str)
-
-    parts.append(clouds_str)
-    parts.append(f"{temp_str}/{dew_str}")
-    parts.append(qnh_str)
-    parts.append(style)
-
-    return " ".join(parts)
-
-
-def format_weather_report(icao: str) -> str | None:
-    """
-    Build a human-friendly weather string for an airport using the
-    current zone state and the condition definitions from weather.json.
-    """
-    icao = icao.upper()
-    state = get_weather_for_airport(icao)
-    if not state:
-        return None
-
-    cond = state["condition"]
-    cond_cfg = CONDITION_CONFIGS.get(cond, {})
-    desc = cond_cfg.get("description", cond.lower())
-    vis = state.get("visibility", "GOOD").lower()
-    style = state.get("style", "VFR")
-
-    return (
-        f"{icao} weather: winds {state['wind_dir']:03.0f} at {state['wind_speed']} knots, "
-        f"visibility {vis}, {desc}, temperature {state['temp']}C, "
-        f"QNH {state['qnh']}, flight conditions {style}."
-    )
-
-
-WEATHER_UPDATE_INTERVAL = 10 * 60  # 10 minutes
-
-def update_all_weather():
-    now = time.time()
-    for zone_name, state in WEATHER_STATE.items():
-        if now - state.get("last_update", 0) >= WEATHER_UPDATE_INTERVAL:
-            update_zone_weather(state)
-
-def record_emergency(airport_code: str, callsign: str, emergency_type: str, runway: str | None = None):
-    """
-    Store an active emergency for this airport + callsign.
-    """
-    key = (airport_code.upper(), callsign.upper())
-    ACTIVE_EMERGENCIES[key] = {
-        "type": emergency_type,
-        "runway": runway,
-        "started_at": time.time(),
-    }
-
-
-def get_active_emergency(airport_code: str, callsign: str) -> dict | None:
-    return ACTIVE_EMERGENCIES.get((airport_code.upper(), callsign.upper()))
-
-
-def clear_emergency(airport_code: str, callsign: str):
-    ACTIVE_EMERGENCIES.pop((airport_code.upper(), callsign.upper()), None)
-
-HOUSEKEEP_MIN_INTERVAL = 15  # seconds
-_NEXT_HOUSEKEEP = 0.0
-
-def cleanup_stale_emergencies(now: float | None = None):
-    """
-    Auto-expire emergencies that have been around longer than EMERGENCY_TTL_SECONDS.
-    """
-    if now is None:
-        now = time.time()
-    if not ACTIVE_EMERGENCIES:
-        return
-
-    for key, info in list(ACTIVE_EMERGENCIES.items()):
-        started = info.get("started_at", now)
-        if now - started > EMERGENCY_TTL_SECONDS:
-            ACTIVE_EMERGENCIES.pop(key, None)
-
-def cleanup_stale_flight_plans(now: float | None = None):
-    """
-    Remove flight plans that are older than FLIGHT_PLAN_TTL_SECONDS.
-    Uses ACTIVE_FLIGHT_PLANS as the timestamp source and also clears
-    matching entries in FLIGHT_PLAN_ROUTES.
-    """
-    if now is None:
-        now = time.time()
-
-    if not ACTIVE_FLIGHT_PLANS:
-        return
-
-    # We need list(...) so we can modify the dict while iterating
-    for key, ts in list(ACTIVE_FLIGHT_PLANS.items()):
-        if now - ts > FLIGHT_PLAN_TTL_SECONDS:
-            # key is (airport_code, CALLSIGN)
-            ACTIVE_FLIGHT_PLANS.pop(key, None)
-            FLIGHT_PLAN_ROUTES.pop(key, None)
-
-def cleanup_expired_frequencies(now: float | None = None):
-    """Expire inactive frequency buffers to keep memory bounded."""
-    if now is None:
-        now = time.time()
-    if not channels:
-        return
-
-    for freq, data in list(channels.items()):
-        if now - data.get("last_active", now) > FREQUENCY_EXPIRE_SECONDS:
-            channels.pop(freq, None)
-
-def cleanup_helipads(now: float | None = None):
-    """
-    Rebuild helipad occupancy from active pilot assignments,
-    and drop stale pilot->helipad mappings after HELIPAD_TTL_SECONDS.
-    """
-    if now is None:
-        now = time.time()
-
-    # 1) Drop stale pilot assignments
-    for key, ts in list(PILOT_HELIPAD_LAST_ACTIVITY.items()):
-        if now - ts > HELIPAD_TTL_SECONDS:
-            PILOT_HELIPAD_LAST_ACTIVITY.pop(key, None)
-            PILOT_ASSIGNED_HELIPAD.pop(key, None)
-
-    # 2) Reset all helipad occupancy to 0
-    for icao, pad_map in HELIPADS_BY_AIRPORT.items():
-        occ_map = HELIPAD_OCCUPANCY.setdefault(icao, {})
-        for pad_id in pad_map.keys():
-            occ_map[pad_id] = 0
-
-    # 3) Rebuild occupancy based on remaining (non-stale) pilot assignments
-    for (icao, callsign), pad_id in PILOT_ASSIGNED_HELIPAD.items():
-        occ_map = HELIPAD_OCCUPANCY.setdefault(icao, {})
-        if pad_id in occ_map:
-            occ_map[pad_id] = occ_map.get(pad_id, 0) + 1
-
-
-def housekeeping(force: bool = False):
-    """
-    Throttled cleanup to keep request handlers light.
-    """
-    global _NEXT_HOUSEKEEP
-    now = time.time()
-
-    if not force and now < _NEXT_HOUSEKEEP:
-        return
-    _NEXT_HOUSEKEEP = now + HOUSEKEEP_MIN_INTERVAL
-
-    cleanup_expired_frequencies(now)
-    cleanup_stale_emergencies(now)
-    cleanup_stale_flight_plans(now)
-    cleanup_helipads(now)
-
-def format_freq(freq):
-    if freq < 1000:
-        return f"CH {freq}"
-    mhz = freq // 1000
-    khz = freq % 1000
-    khz_str = f"{khz:03d}"
-    return f"{mhz}.{khz_str} MHz"
-
-def get_runway_state(airport, runway):
-    airport_state = RUNWAY_STATE.setdefault(airport, {})
-    return airport_state.setdefault(runway, {
-            "active": None,          # dict or None
-            "queue": deque(),             # waiting aircraft
-            "expires_at": 0
-        },
-    )
-
-def runway_active(state):
-    return state["active"] and time.time() < state["expires_at"]
-
-def set_runway_active(state, entry, seconds):
-    state["active"] = entry
-    state["expires_at"] = time.time() + seconds
-
-def clear_runway(state):
-    state["active"] = None
-    state["expires_at"] = 0
-
-def choose_runway_for_action(tower_cfg, action):
-    """
-    Select a runway and end for the given action ("landing" or "takeoff").
-
-    Returns:
-        (logical_runway_key, runway_end)
-
-    logical_runway_key: what we use for RUNWAY_STATE (sequencing)
-    runway_end: the textual end we speak in phraseology ("36L", "18L")
-
-    Rules:
-    - If using new-style 'runways' config:
-        * For landing -> only consider runways with non-empty 'landing_ends'
-        * For takeoff -> only consider runways with non-empty 'takeoff_ends'
-        * First matching runway wins (deterministic, no random choice)
-    - If no 'runways' block exists, fall back to old 'landings' / 'departures'.
-    """
-
-    runways_cfg = tower_cfg.get("runways") or []
-
-    # --- New-style config: list of runway dicts ---
-    if runways_cfg and isinstance(runways_cfg[0], dict):
-        for rwy in runways_cfg:
-            if action == "landing":
-                ends = rwy.get("landing_ends") or []
-            elif action == "takeoff":
-                ends = rwy.get("takeoff_ends") or []
-            else:
-                ends = []
-
-            # This runway does NOT handle this operation at all
-            if not ends:
-                continue
-
-            # This runway is valid for this operation -> use it
-            runway_end = ends[0]  # first defined end; deterministic
-            logical_id = rwy.get("physical_id") or rwy.get("id") or runway_end
-            return logical_id, runway_end
-
-    # --- Fallback: old-style config using plain lists ---
-    if action == "landing":
-        choices = tower_cfg.get("landings") or tower_cfg.get("runways", [])
-    elif action == "takeoff":
-        choices = tower_cfg.get("departures") or tower_cfg.get("runways", [])
-    else:
-        choices = tower_cfg.get("runways", [])
-
-    if not choices:
-        return "DEFAULT", ""
-
-    # Old behaviour: first runway in the list
-    runway_end = choices[0]
-    logical_id = runway_end
-    return logical_id, runway_end
-
-def normalize_atc_message(message_text: str, sender_name: str):
-    """
-    Supports:
-      AIRPORT, CALLSIGN, request ...
-      AIRPORT, request ...
-
-    Returns: (airport_code, callsign, request_text) or (None, None, None)
-    """
-    # Limit splits so commas in the request are preserved
-    parts = [x.strip() for x in message_text.split(",", 2)]
-
-    if len(parts) < 2:
-        return None, None, None
-
-    airport_code = parts[0].upper()
-
-    if len(parts) == 2:
-        # Example: "SLHA, request takeoff."
-        callsign = sender_name
-        request_text = parts[1]
-        return airport_code, callsign, request_text
-
-    # Example: "SLHA, N463R6, request takeoff."
-    callsign = parts[1].strip() or sender_name
-    request_text = parts[2]
-    return airport_code, callsign, request_text
-
-def is_flight_plan_request(request_text: str) -> bool:
-    """
-    Minimal flight plan detector based on JSON-configured triggers.
-    """
-    t = (request_text or "").lower()
-    for phrase in FP_TRIGGERS:
-        if phrase and phrase in t:
-            return True
-    return False
-
-def extract_route(text: str, fallback_origin: str):
-    """
-    Returns (origin, destination)
-    """
-    m = DEST_ONLY_PATTERN.search(text)
-    if m:
-        return fallback_origin.upper(), m.group(1).upper()
-
-    m = ROUTE_PATTERN.search(text)
-    if m:
-        return m.group(1).upper(), m.group(2).upper()
-
-    # 3) Nothing found
-    return fallback_origin.upper(), None
-
-def process_runway_sequencing():
-    if not SEQUENCING.get("enabled", False):
-        return
-    if not SEQUENCING.get("auto_clear_next", False):
-        return
-
-    now = time.time()
-
-    for airport_code, runways in RUNWAY_STATE.items():
-        for runway, state in runways.items():
-
-            # Expire active runway
-            if state["active"] and now >= state["expires_at"]:
-                clear_runway(state)
-
-            # Auto-clear next
-            if not state["active"] and state["queue"]:
-                entry = state["queue"].popleft()
-
-                occupy = OCCUPANCY.get(entry["action"], 30)
-                set_runway_active(state, entry, occupy)
-
-                templates = AUTO_CLEAR_RESPONSES.get(entry["action"], [])
-                if templates:
-                    template = random.choice(templates)
-                    text = template.format(
-                        callsign=entry["callsign"],
-                        runway=entry["runway"],
-                        airport=entry["airport"]
-                    )
-                else:
-                    # fallback
-                    if entry["action"] == "landing":
-                        text = f"{entry['callsign']}, cleared to land runway {entry['runway']}."
-                    else:
-                        text = f"{entry['callsign']}, cleared for takeoff runway {entry['runway']}."
-                    
-                # Flight plan departure handoff for auto-cleared takeoffs
-                if entry["action"] == "takeoff":
-                    key = (entry["airport"], entry["callsign"].upper())
-                    if key in ACTIVE_FLIGHT_PLANS:
-                        ACTIVE_FLIGHT_PLANS.pop(key, None)
-
-                        if FP_HANDOFF_RESPONSES and FP_HANDOFF_CHANCE > 0.0:
-                            if random.random() < FP_HANDOFF_CHANCE:
-                                handoff_template = random.choice(FP_HANDOFF_RESPONSES)
-                                tower_cfg = ATC_TOWERS.get(entry["airport"], {})
-                                tower_freq_for_handoff = tower_cfg.get(
-                                    "tower_frequency",
-                                    tower_cfg.get("frequency", DEFAULT_FREQUENCY)
-                                )
-                                freq_str = format_freq(tower_freq_for_handoff)
-                                handoff_text = handoff_template.format(
-                                    AIRPORT=entry["airport"],
-                                    FREQUENCY=freq_str,
-                                )
-                                text = f"{text} {handoff_text}"
-
-                freq = entry["frequency"]
-                ch = get_channel(freq)
-                if ch:
-                    ch["messages"].append({
-                        "id": ch["next_id"],
-                        "text": text[0].upper() + text[1:],
-                        "sender": entry["sender"],
-                    })
-                    ch["next_id"] += 1
-
-# ---------------------------
-# ATC Bot Logic
-# ---------------------------
-def handle_atc(message_text: str, channel: int, sender_name: str):
-    """
-    Process ATC bot responses.
-    Message format: AIRPORT_CODE, CALLSIGN, request ...
-    """
-
-    # --- Parse & normalize (fills callsign if user omitted it) ---
-    airport_code, callsign, request_text = normalize_atc_message(
-        message_text,
-        sender_name,
-    )
-
-    if not airport_code or not request_text:
-        return None
-
-    original_request_text = request_text
-    request_text = request_text.lower()
-
-    # --- Emergency detection ---
-    # 1) Type from JSON-defined triggers (mayday / pan / generic)
-    emergency_type = detect_emergency_type(original_request_text)
-    has_emergency = emergency_type != EMERGENCY_TYPE_NONE
-
-    # 2) Extra safety pass using flattened trigger list
-    if not has_emergency and EMERGENCY_TRIGGER_PHRASES:
-        if any(p.lower() in request_text for p in EMERGENCY_TRIGGER_PHRASES):
-            has_emergency = True
-            if emergency_type == EMERGENCY_TYPE_NONE:
-                emergency_type = EMERGENCY_TYPE_GENERIC
-
-    # 3) Optional "sounds like" fuzziness
-    if not has_emergency and sounds_like_possible_emergency(original_request_text):
-        has_emergency = True
-        if emergency_type == EMERGENCY_TYPE_NONE:
-            emergency_type = EMERGENCY_TYPE_GENERIC
-
-    is_helicopter = is_helicopter_request(original_request_text, callsign)
-
-    requested_runway = parse_requested_runway(request_text)  # e.g. "27L"
-    pilot_key = (airport_code, callsign)
-
-    tower = ATC_TOWERS.get(airport_code)
-    if not tower:
-        return None
-
-    # --- Base frequencies for this airport ---
-    tower_freq = tower.get("tower_frequency", tower.get("frequency", DEFAULT_FREQUENCY))
-    ground_freq = tower.get("ground_frequency", tower_freq)  # same as tower if no ground freq
-
-    # --- Classify the request intent ---
-    # Ground ONLY handles taxi / pushback
-    is_ground_request = any(p in request_text for p in GROUND_TRIGGER_PHRASES)
-
-    # Tower-style requests (takeoff / landing, you can add more actions)
-    is_tower_request = any(p in request_text for p in TOWER_TRIGGER_PHRASES)
-
-    # =========================================================
-    # 1) Redirects: real ground/tower requests on the *wrong* freq
-    # =========================================================
-
-    # A) Ground-style requests (taxi / startup) on TOWER frequency -> redirect to GROUND
-    if (is_ground_request
-        and tower_freq != ground_freq
-        and channel == tower_freq
-    ):
-
-        # Special-case startup redirect if desired
-        is_startup_request = any(p in request_text for p in STARTUP_TRIGGER_PHRASES)
-
-        if is_startup_request:
-            templates = REDIRECT_MESSAGES.get("startup_tower_to_ground", [])
-            # Fall back to generic tower_to_ground if startup-specific empty
-            if not templates:
-                templates = REDIRECT_MESSAGES.get("tower_to_ground", [])
-        else:
-            templates = REDIRECT_MESSAGES.get("tower_to_ground", [])
-
-        if templates:
-            template = random.choice(templates)
-            text = template.format(
-                callsign=callsign,
-                airport=airport_code,
-                # These messages talk about CONTACT GROUND on {frequency}
-                frequency=format_freq(ground_freq),
-            )
-            text = text[0].upper() + text[1:]
-
-            tower_sender = tower.get("tower_sender", f"{airport_code} Tower")
-            return text, tower_sender
-
-            # No templates? just ignore like before
-        return None
-
-    # B) Tower-style requests (takeoff / landing) on GROUND frequency -> redirect to TOWER
-    if (
-        is_tower_request
-        and tower_freq != ground_freq
-        and channel == ground_freq
-    ):
-
-        templates = REDIRECT_MESSAGES.get("ground_to_tower", [])
-        if templates:
-            template = random.choice(templates)
-            text = template.format(
-                callsign=callsign,
-                airport=airport_code,
-                # These messages talk about CONTACT TOWER on {frequency}
-                frequency=format_freq(tower_freq),
-            )
-            text = text[0].upper() + text[1:]
-
-            ground_sender = tower.get("ground_sender", f"{airport_code} Ground")
-            return text, ground_sender
-
-        return None
-
-    # =========================================================
-    # 2) If the tuned frequency doesn't belong to this airport
-    #    (Emergencies are allowed to bypass this)
-    # =========================================================
-    if channel not in (tower_freq, ground_freq):
-        # For emergencies, treat as if they reached this airport's ATC anyway
-        if has_emergency:
-            # We just continue without redirecting; role will default to Tower.
-            pass
-        else:
-            responses = REDIRECT_MESSAGES.get("wrong_airport_frequency", [])
-            if not responses:
-                return None
-
-            template = random.choice(responses)
-
-            # Prefer tower if this handler has tower_freq, otherwise ground
-            if (is_tower_request and not is_flight_plan_request(original_request_text)):
-                correct_freq = tower_freq
-                sender_role = tower.get("tower_sender", f"{airport_code} Tower")
-            elif (is_ground_request and not is_flight_plan_request(original_request_text)):
-                correct_freq = ground_freq
-                sender_role = tower.get("ground_sender", f"{airport_code} Ground")
-            else:
-                return None
-
-            freq_str = format_freq(correct_freq)
-
-            response_text = template.format(
-                CALLSIGN=callsign,
-                REQUESTED_AIRPORT=airport_code,
-                FREQUENCY=freq_str
-            )
-            full_text = f"{callsign}, {response_text}"
-
-            full_text = full_text[0].upper() + full_text[1:]
-            return full_text, sender_role
-
-
-    # =========================================================
-    # 3) Determine role based on the frequency we are actually tuned to
-    # =========================================================
-    if channel == ground_freq and ground_freq != tower_freq:
-        role = "ground"
-        sender_name = tower.get("ground_sender", f"{airport_code} Ground")
-    else:
-        # Default: tower (covers both tower freq and single-frequency airports)
-        role = "tower"
-        sender_name = tower.get("tower_sender", f"{airport_code} Tower")
-
-    # =========================================================
-    # 4) Flight plan handling (simple: store flag, send canned reply)
-    # =========================================================
-    if is_flight_plan_request(request_text):
-        # Mark this callsign as having a flight plan at this airport
-        ACTIVE_FLIGHT_PLANS[(airport_code, callsign.upper())] = time.time()
-
-        origin, destination = extract_route(original_request_text, airport_code)
-
-        FLIGHT_PLAN_ROUTES[(airport_code, callsign.upper())] = {
-        "origin": origin,
-        "destination": destination,
-        }
-
-        usable_templates = []
-
-        for t in FP_RESPONSES:
-            if "{DESTINATION}" in t:
-                if destination:
-                    usable_templates.append(t)
-            else:
-                usable_templates.append(t)
-
-        # Fallback safety
-        if not usable_templates:
-            usable_templates = FP_RESPONSES
-
-        template = random.choice(usable_templates)
-
-        fp_text = template.format(
-            CALLSIGN=callsign,
-            AIRPORT=airport_code,
-            ORIGIN=origin or airport_code,
-            DESTINATION=destination or "",
-        )
-
-        fp_text = fp_text[0].upper() + fp_text[1:]
-
-        # Always respond as Tower for flight plans
-        sender_name = tower.get("sender", f"{airport_code} ATC")
-        return fp_text, sender_name
-
-    # =========================================================
-    # 5) Normal ATC trigger matching
-    # =========================================================
-
-    for action, phrases in TRIGGER_PHRASES.items():
-        for phrase in phrases:
-            if phrase in request_text:
-
-                helicopter_full_text = False
-
-                effective_action = action
-
-                # If an emergency was declared but we matched some generic/emergency action
-                # (e.g. action == "emergency"), treat it as a landing by default.
-                if has_emergency and effective_action not in ("landing", "takeoff", "taxi"):
-                    effective_action = "landing"
-
-                if has_emergency and effective_action == "landing":
-                # Use emergency landing templates from auto_clear if present; fall back to normal landing
-                    templates_pool = (
-                        AUTO_CLEAR_RESPONSES.get("emergency_landing_clearance")
-                        or ATC_RESPONSES.get("landing", [])
-                    )
-                else:
-                    templates_pool = ATC_RESPONSES.get(effective_action, [])
-
-                if not templates_pool:
-                    # No templates for this action; move on to next match
-                    continue
-
-                template = random.choice(templates_pool)
-
-                # --------------------------------------------------
-                # Runway selection (now using JSON runway config)
-                # --------------------------------------------------
-                logical_runway_id = None
-                runway = ""
-                helipad_id = None
-
-                # Helicopter → prefer helipads if defined for this airport
-                if is_helicopter and action in ("landing", "takeoff"):
-                    # Did they mention a specific pad in the text?
-                    requested_helipad = find_requested_helipad(airport_code, original_request_text)
-
-                    # For takeoff: if they didn’t say a pad, try the pad we remembered from landing
-                    if action == "takeoff" and not requested_helipad:
-                        remembered_pad = PILOT_ASSIGNED_HELIPAD.get(pilot_key)
-                        if remembered_pad:
-                            requested_helipad = remembered_pad
-
-                    helipad_id, helipad_mode = assign_helipad(airport_code, requested_helipad, action)
-
-                    if helipad_mode == "hold":
-                        # Multi-pad airport, all pads full
-                        hold_text = f"{callsign}, all helipads are currently occupied, standby."
-                        hold_text = hold_text[0].upper() + hold_text[1:]
-                        return hold_text, sender_name
-
-                    if helipad_mode == "anywhere":
-                        # Single-pad airport, pad is full -> let them land anywhere
-                        # If we know the pad id, include it for flavor
-                        pad_map = HELIPADS_BY_AIRPORT.get(airport_code, {})
-                        pad_name = None
-                        if pad_map:
-                            # Just grab the first pad id/name if any
-                            only_id = next(iter(pad_map.keys()))
-                            pad_name = only_id
-
-                        if pad_name:
-                            anywhere_text = (
-                                f"{callsign}, helipad {pad_name} is occupied, "
-                                f"cleared to land anywhere on the field."
-                            )
-                        else:
-                            anywhere_text = (
-                                f"{callsign}, helipad is occupied, cleared to land anywhere on the field."
-                            )
-
-                        anywhere_text = anywhere_text[0].upper() + anywhere_text[1:]
-                        return anywhere_text, sender_name
-
-                    # If we got a helipad_id, we intentionally do NOT pick a runway
-                    if helipad_id:
-                        logical_runway_id = None
-                        runway = ""
-
-                # Fixed-wing runway logic (or helicopters at airports with no helipads)
-                if action in ("landing", "takeoff"):
-                    if action == "takeoff":
-                        valid = runway_ends_for_action(tower, "takeoff")
-
-                        # 1) Honor explicit requested runway if valid
-                        if requested_runway and requested_runway.upper() in valid:
-                            runway = requested_runway.upper()
-                            logical_runway_id = physical_id_for_runway_end(tower, runway)
-                            PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
-
-                        else:
-                            # 2) Reuse taxi-assigned runway if valid
-                            assigned = PILOT_ASSIGNED_RUNWAY.get(pilot_key)
-                            if assigned and assigned in valid:
-                                runway = assigned
-                                logical_runway_id = physical_id_for_runway_end(tower, runway)
-                            else:
-                                # 3) Fall back to existing chooser
-                                logical_runway_id, runway = choose_runway_for_action(tower, action)
-                                if runway:
-                                    PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
-
-                    else:
-                        # landing:
-                        valid = runway_ends_for_action(tower, "landing")
-
-                        if requested_runway and requested_runway.upper() in valid:
-                            runway = requested_runway.upper()
-                            logical_runway_id = physical_id_for_runway_end(tower, runway)
-                            PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
-                        else:
-                            logical_runway_id, runway = choose_runway_for_action(tower, action)
-                            if runway:
-                                PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
-
-
-                elif action == "taxi":
-                    valid = runway_ends_for_action(tower, "taxi")
-
-                    # 1) If pilot explicitly requested a runway and it's valid for taxi → honor it
-                    if requested_runway and requested_runway.upper() in valid:
-                        runway = requested_runway.upper()
-                        PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
-
-                    else:
-                        # 2) Reuse previously assigned runway (keeps taxi->takeoff consistent)
-                        assigned = PILOT_ASSIGNED_RUNWAY.get(pilot_key)
-                        if assigned and assigned in valid:
-                            runway = assigned
-                        else:
-                            # 3) Otherwise pick a runway (random or your own strategy)
-                            runway = random.choice(sorted(valid)) if valid else ""
-                            if runway:
-                                PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
-
-
-                elif action == "startup":
-                    # startup does not need a runway
-                    logical_runway_id = None
-                    runway = ""
-
-                else:
-                    # Other actions (non-runway-specific)
-                    base_choices = (
-                        tower.get("runways")
-                        or tower.get("landings")
-                        or tower.get("departures")
-                        or []
-                    )
-                    runway = base_choices[0] if base_choices else ""
-
-                # --------------------------------------------------
-                # Emergency bookkeeping: record which runway we gave them
-                # --------------------------------------------------
-                if has_emergency and action == "landing" and runway:
-                    record_emergency(airport_code, callsign, emergency_type, runway)
-
-                                # --------------------------------------------------
-                # Runway sequencing (landing / takeoff only)
-                # Emergencies are allowed to override existing occupancy.
-                # --------------------------------------------------
-                if (
-                    SEQUENCING.get("enabled", True)
-                    and role == "tower"
-                    and action in ("landing", "takeoff")
-                    and not is_helicopter
-                ):
-                    # Group by physical runway when using new config;
-                    # fall back to using the runway end string otherwise.
-                    runway_key = logical_runway_id or runway or "DEFAULT"
-                    state = get_runway_state(airport_code, runway_key)
-
-                    if has_emergency and action == "landing":
-                        occupy = OCCUPANCY.get("emergency_landing", OCCUPANCY.get(action, 60))
-                    else:
-                        occupy = OCCUPANCY.get(action, 30)
-
-                    entry = {
-                        "airport": airport_code,
-                        "runway": runway,    # end used in messages
-                        "callsign": callsign,
-                        "action": action,
-                        "frequency": channel,
-                        "sender": sender_name,
-                        "emergency": has_emergency,
-                    }
-
-                    # Check if there's already an active aircraft and whether it's an emergency
-                    active = state.get("active") or state.get("current")  # depends on your structure
-                    active_is_emergency = bool(active and active.get("emergency"))
-
-                    if runway_active(state):
-
-                        if not has_emergency:
-                            # ---- NORMAL TRAFFIC WHILE RUNWAY IS BUSY ----
-                            # Always queue normal traffic so process_runway_sequencing()
-                            # can auto-clear it later.
-                            state["queue"].append(entry)
-
-                            position = len(state["queue"]) + 1
-
-                            # If the *current* active aircraft is an emergency, prefer the
-                            # spial emergency-hold messages, otherwise normal hold text.
-                            if active_is_emergency:
-                                # --- NEW: hold normal traffic due to active emergency ---
-                                hold_templates = HOLD_MESSAGES.get("emergency_hold_traffic", []) or HOLD_MESSAGES.get(action, [])
-                            
-                            else:
-                                hold_templates = HOLD_MESSAGES.get(action, [])
-
-                            if hold_templates:
-                                hold_template = random.choice(hold_templates)
-                                # You can include emergency runway / callsign in the message later
-                                hold_text = hold_template.format(
-                                    callsign=callsign,
-                                    runway=runway,
-                                    position=position,
-                                )
-                            else:
-                                if active_is_emergency:
-                                    hold_text = (
-                                        f"{callsign}, hold, runway blocked due to "
-                                        f"emergency traffic."
-                                    )
-                                else:
-                                    hold_text = f"{callsign}, hold, traffic in sequence."
-
-                            hold_text = hold_text[0].upper() + hold_text[1:]
-                            return hold_text, sender_name
-                        
-                        if active and not active_is_emergency:
-                            state["queue"].append(active)
-
-                    # Either runway is free OR this is an emergency:
-                    # mark it active for this aircraft (emergency overrides whoever was there).
-                    set_runway_active(state, entry, occupy)
-
-
-                # --------------------------------------------------
-                # If pilot requested an invalid runway, override with
-                # a friendly "unable, use {runway}" style message
-                # --------------------------------------------------
-                # --------------------------------------------------
-                # Invalid runway request handling (JSON-driven)
-                # --------------------------------------------------
-                if action in ("landing", "takeoff") and requested_runway and not is_helicopter:
-                    requested_norm = requested_runway.upper()
-                    valid_for_action = runway_ends_for_action(tower, action)
-
-                    if requested_norm not in valid_for_action and runway:
-                        templates = INVALID_RUNWAY_MESSAGES.get(action, [])
-                        if templates:
-                            template = random.choice(templates)
-                            invalid_text = template.format(
-                                callsign=callsign,
-                                requested=requested_norm,
-                                runway=runway,
-                            )
-                            invalid_text = invalid_text[0].upper() + invalid_text[1:]
-                            return invalid_text, sender_name
-
-                # --- Build response text with runway/taxiway placeholders ---
-                if "{taxiway}" in template and "taxiways" in tower:
-                    taxiway = random.choice(tower["taxiways"])
-                    response_text = template.format(
-                        landings=runway,
-                        departures=runway,
-                        taxiway=taxiway,
-                    )
-                else:
-                    response_text = template.format(
-                        callsign=callsign,
-                        landings=runway,
-                        departures=runway,
-                    )
-
-                # --- Helicopter-specific phrasing (JSON-driven) ---
-                # For helicopters requesting takeoff/landing, switch to helicopter_* responses.
-                if is_helicopter and effective_action in ("takeoff", "landing"):
-                    heli_text = choose_helicopter_response(airport_code, effective_action, callsign, helipad=helipad_id)
-                    if heli_text:
-                        response_text = heli_text
-                        helicopter_full_text = True
-
-                # --- Ground → Tower handoff (only when actually on Ground) ---
-                if role == "ground" and action == "taxi":
-                    if tower_freq != ground_freq:
-                        if random.random() < 0.8:  # 80% chance
-                            handoffs = HANDOFF_MESSAGES.get("ground_to_tower", [])
-                            if handoffs:
-                                handoff_template = random.choice(handoffs)
-                                formatted_freq = format_freq(tower_freq)
-                                handoff_text = handoff_template.format(
-                                    airport=airport_code,
-                                    frequency=formatted_freq,
-                                )
-                                response_text = f"{response_text}, {handoff_text}"
-
-                # --- Flight plan departure handoff (Tower, takeoff only) ---
-                if action == "takeoff" and role == "tower":
-                    key = (airport_code, callsign.upper())
-                    route_info = FLIGHT_PLAN_ROUTES.pop(key, None)
-
-                    if key in ACTIVE_FLIGHT_PLANS:
-                        # Drop the plan as soon as we issue a takeoff clearance
-                        ACTIVE_FLIGHT_PLANS.pop(key, None)
-
-                        if FP_HANDOFF_RESPONSES and FP_HANDOFF_CHANCE > 0.0:
-                            if random.random() < FP_HANDOFF_CHANCE:
-                                handoff_template = random.choice(FP_HANDOFF_RESPONSES)
-                                # Default: handoff is back to the *current* airport tower
-                                handoff_airport = airport_code
-                                handoff_freq = tower.get(
-                                    "tower_frequency",
-                                    tower.get("frequency", DEFAULT_FREQUENCY)
-                                )
-
-                                # If we have a destination from the flight plan, try to hand off there instead
-                                dest_icao = None
-                                if route_info:
-                                    dest_icao = route_info.get("destination")
-
-                                if dest_icao:
-                                    dest_tower = ATC_TOWERS.get(dest_icao.upper())
-                                    if dest_tower:
-                                        dest_freq = dest_tower.get(
-                                            "tower_frequency",
-                                            dest_tower.get("frequency", DEFAULT_FREQUENCY)
-                                        )
-                                        if dest_freq:
-                                            handoff_airport = dest_icao.upper()
-                                            handoff_freq = dest_freq
-
-                                freq_str = format_freq(handoff_freq)
-
-                                # Allow templates to use AIRPORT and/or DESTINATION for the handoff airport
-                                handoff_text = handoff_template.format(
-                                    AIRPORT=handoff_airport,
-                                    DESTINATION=handoff_airport,
-                                    FREQUENCY=freq_str,
-                                )
-                                response_text = f"{response_text}, {handoff_text}"
-
-                # --- Emergency acknowledgements and traffic hold calls ---
-                if has_emergency and role == "tower" and action == "landing":
-                    # 1) Pick the right ack family
-                    if emergency_type == EMERGENCY_TYPE_MAYDAY:
-                        ack_pool = ATC_RESPONSES.get("emergency_ack_mayday", [])
-                    elif emergency_type == EMERGENCY_TYPE_PAN:
-                        ack_pool = ATC_RESPONSES.get("emergency_ack_pan", [])
-                    else:
-                        ack_pool = ATC_RESPONSES.get("emergency_ack_generic", [])
-
-                    if ack_pool:
-                        ack_template = random.choice(ack_pool)
-                        ack_text = ack_template.format(
-                            CALLSIGN=callsign,
-                            AIRPORT=airport_code,
-                        )
-                    else:
-                        ack_text = f"{callsign}, roger, emergency acknowledged."
-
-                    # 2) Optional broadcast-style traffic hold message
-                    emergency_hold_pool = HOLD_MESSAGES.get("emergency_hold_traffic", [])
-                    hold_broadcast = ""
-                    if emergency_hold_pool and random.random() < 0.6:
-                        hold_broadcast = " " + random.choice(emergency_hold_pool)
-
-                    # Stick ack in front, broadcast at the end
-                    response_text = f"{ack_text} {response_text}{hold_broadcast}".strip()
-                    
-
-                # --- Helipad occupancy bookkeeping ---
-                                # --- Helipad bookkeeping (pilot assignment only; occupancy is derived) ---
-                now_ts = time.time()
-
-                if is_helicopter and helipad_id and action == "landing":
-                    # Remember which pad this pilot is on
-                    PILOT_ASSIGNED_HELIPAD[pilot_key] = helipad_id
-                    PILOT_HELIPAD_LAST_ACTIVITY[pilot_key] = now_ts
-
-                if is_helicopter and action == "takeoff":
-                    # Pilot is leaving; drop their pad assignment
-                    if pilot_key in PILOT_ASSIGNED_HELIPAD:
-                        PILOT_ASSIGNED_HELIPAD.pop(pilot_key, None)
-                    PILOT_HELIPAD_LAST_ACTIVITY.pop(pilot_key, None)
-
-
-                if helicopter_full_text:
-                    # Helicopter templates already include the callsign
-                    full_text = response_text
-                else:
-                    full_text = f"{callsign}, {response_text}"
-
-                capitalized = full_text[0].upper() + full_text[1:]
-
-                # Use per-role sender_name (Tower / Ground)
-                return capitalized, sender_name
-            
-    # =========================================================
-    # 5b) Emergency fallback: emergency but no action matched
-    # =========================================================
-    if has_emergency:
-        if emergency_type == EMERGENCY_TYPE_MAYDAY:
-            ack_pool = ATC_RESPONSES.get("emergency_ack_mayday", [])
-        elif emergency_type == EMERGENCY_TYPE_PAN:
-            ack_pool = ATC_RESPONSES.get("emergency_ack_pan", [])
-        else:
-            ack_pool = ATC_RESPONSES.get("emergency_ack_generic", [])
-
-        if ack_pool:
-            ack_template = random.choice(ack_pool)
-            ack_text = ack_template.format(
-                CALLSIGN=callsign,
-                AIRPORT=airport_code,
-            )
-        else:
-            ack_text = f"{callsign}, roger, emergency acknowledged."
-
-        ack_text = ack_text[0].upper() + ack_text[1:]
-        return ack_text, sender_name
-
-    # =========================================================
-    # 5c) Fallback: unknown / unrecognized request on a valid freq
-    # =========================================================
-    templates = UNKNOWN_MESSAGES.get(role) or UNKNOWN_MESSAGES.get("default", [])
-    if templates:
-        template = random.choice(templates)
-        unknown_text = template.format(
-            callsign=callsign,
-            airport=airport_code,
-        )
-        unknown_text = unknown_text[0].upper() + unknown_text[1:]
-
-        return unknown_text, sender_name
-
-    # No unknown templates defined, behave like original: silent
-    return None
-
-@app.route("/")
-def index():
-    housekeeping()
-    return jsonify({
-        "status": "online",
-        "instance_id": SERVER_INSTANCE_ID,
-        "active_frequencies": len(channels)
-    })
-
-@app.route("/atc/lookup", methods=["GET"])
-def atc_lookup():
-    airport = request.args.get("airport", "").upper()
-    role = request.args.get("role", "tower").lower()  # "tower" or "ground"
-
-    tower = ATC_TOWERS.get(airport)
-    if not tower:
-        return jsonify({"error": "unknown airport"}), 404
-
-    # Determine frequency based on role
-    if role == "ground":
-        freq = tower.get("ground_frequency", tower.get("frequency", DEFAULT_FREQUENCY))
-        sender = tower.get("ground_sender", f"{airport} Ground")
-    else:
-        freq = tower.get("tower_frequency", tower.get("frequency", DEFAULT_FREQUENCY))
-        sender = tower.get("tower_sender", f"{airport} Tower")
-
-    update_all_weather()
-    state = get_weather_for_airport(airport)
-    metar = None
-    if state:
-        body = format_metar_from_state(airport, state)
-        if body:
-            metar = f"METAR {body}"
-
-    return jsonify({
-        "airport": airport,
-        "frequency": freq,
-        "sender": sender,
-        "metar": metar
-    })
-
-@app.route("/state", methods=["GET"])
-def get_state():
-    housekeeping()
-
-    freq = int(request.args.get("frequency", 16))
-
-    if freq not in channels:
-        return jsonify({
-            "frequency": freq,
-            "last_id": 0
-        })
-
-    channel = channels[freq]
-
-    return jsonify({
-        "frequency": freq,
-        "last_id": channel["next_id"] - 1
-    })
-
-@app.route("/send", methods=["POST"])
-def send_message():
-    housekeeping()
-    process_runway_sequencing()
-    update_all_weather()
-
-    data = request.get_json(force=True)
-
-    freq = int(data.get("frequency", 16))
-    text = data.get("text", "").strip()
-    sender = data.get("sender", "UNKNOWN")
-    sender_uuid = data.get("sender_uuid")
-
-    app.logger.info(
-        "[RX /send] freq=%r sender=%r text=%r full_json=%s",
-        freq,
-        sender,
-        text,
-        json.dumps(data, ensure_ascii=False)
-    )
-
-    if not text:
-        return jsonify({"error": "empty message"}), 400
-    
-     # --- Dedicated-channel TX permission check (GNN, etc.) ---
-    if not can_transmit_on_frequency(freq, sender_uuid):
-        return jsonify({
-            "status": "blocked",
-            "error": "TX_NOT_ALLOWED",
-            "reason": "CHANNEL_RECV_ONLY"
-        }), 403
-
-    channel = get_channel(freq)
-
-    msg = {
-        "id": channel["next_id"],
-        "text": text,
-        "sender": sender
-    }
-
-    channel["messages"].append(msg)
-    channel["next_id"] += 1
-
-    atc_response = handle_atc(text, freq, sender)
-    if atc_response:
-        atc_text, atc_sender = atc_response
-        atc_msg = {
-            "id": channel["next_id"],
-            "text": atc_text,
-            "sender": atc_sender
-        }
-        channel["messages"].append(atc_msg)
-        channel["next_id"] += 1
-
-    return jsonify({
-        "status": "sent",
-        "id": msg["id"]
-    })
-
-
-@app.route("/fetch", methods=["GET"])
-def fetch_messages():
-    housekeeping()
-    process_runway_sequencing()
-
-    freq = int(request.args.get("frequency", 16))
-    since_id = int(request.args.get("since_id", 0))
-
-    app.logger.info(
-        "[RX /fetch] freq=%r since=%r query=%r",
-        freq,
-        since_id,
-        dict(request.args)
-    )
-
-    if freq not in channels:
-        return jsonify({
-            "instance_id": SERVER_INSTANCE_ID,
-            "messages": []
-        })
-
-    channel = get_channel(freq)
-
-    msgs = [
-        m for m in channel["messages"]
-        if m["id"] > since_id
-    ]
-
-    return jsonify({
-        "instance_id": SERVER_INSTANCE_ID,
-        "messages": msgs
-    })
-
-@app.route("/weather", methods=["POST"])
-def get_weather():
-    """
-    Return simulated weather for a given airport.
-
-    Request JSON:
-      { "airport": "SLHA" }
-
-    Response JSON (200):
-      {
-        "ok": true,
-        "airport": "SLHA",
-        "zone": "NORTH_COAST",
-        "condition": "FEW",
-        "visibility": "GOOD",
-        "style": "VFR",
-        "wind_dir": 190,
-        "wind_speed": 8,
-        "temp": 18,
-        "qnh": 1015,
-        "report": "SLHA weather: winds 190 at 8 knots, visibility good, few clouds, temperature 18°C, QNH 1015, flight conditions VFR."
-      }
-    """
-    data = request.get_json(force=True, silent=True) or {}
-    icao = data.get("airport", "").upper().strip()
-
-    if not icao:
-        return jsonify({"ok": False, "error": "Missing 'airport' field"}), 400
-
-    # Advance weather sim so it stays alive even if nobody's sending on /send
-    update_all_weather()
-
-    state = get_weather_for_airport(icao)
-    if not state:
-        return jsonify({"ok": False, "error": f"Unknown airport '{icao}'"}), 404
-
-    report = format_weather_report(icao)
-
-    return jsonify({
-        "ok": True,
-        "airport": icao,
-        "zone": state.get("zone"),
-        "condition": state.get("condition"),
-        "visibility": state.get("visibility"),
-        "style": state.get("style"),
-        "wind_dir": state.get("wind_dir"),
-        "wind_speed": state.get("wind_speed"),
-        "temp": state.get("temp"),
-        "qnh": state.get("qnh"),
-        "report": report
-    })
-
-
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=10000)
\ No newline at end of file
+from flask import Flask, g, request # pyright: ignore[reportMissingImports]
+import functools
+import hashlib
+import time
+import json
+import random
+import re
+import sys
+import uuid
+import heapq
+import threading
+from collections import deque, OrderedDict
+from itertools import islice
+from datetime import datetime
+from zoneinfo import ZoneInfo
+import logging
+
+
+app = Flask(__name__)
+
+# Make sure Python's root logging is at least INFO
+logging.basicConfig(level=logging.INFO)
+
+# Make sure Flask's logger is also INFO
+app.logger.setLevel(logging.INFO)
+
+app.logger.info("🔥 ATC server starting up, custom logging should be visible")
+
+# Load airports and triggers from JSON
+with open("airports.json", "r") as f:
+    airport_data = json.load(f)
+
+with open("atc_config.json", "r") as f:
+    atc_config = json.load(f)
+
+with open("channels.json") as f:
+    CHANNELS_CONFIG = json.load(f)["channels"]
+
+with open("weather.json") as f:
+    WEATHER_CONFIG = json.load(f)
+
+def _tx_allow(sender_uuid):
+    return True
+
+def _tx_deny(sender_uuid):
+    return False
+
+CHANNELS_BY_FREQ = {}
+for channel_id, cfg in CHANNELS_CONFIG.items():
+    freq = cfg["frequency"]
+
+    tx_policy = cfg.get("tx_policy", {})
+    if tx_policy.get("mode") == "whitelist_uuid":
+        tx_policy["allowed_uuids_set"] = frozenset(tx_policy.get("allowed_uuids", []))
+
+    # Resolve the policy switch once at load into a single callable
+    mode = tx_policy.get("mode", "open")
+    if mode == "open":
+        tx_check = _tx_allow
+    elif mode == "whitelist_uuid":
+        tx_check = tx_policy["allowed_uuids_set"].__contains__
+    else:
+        # server_only, and any unknown future mode, is receive-only
+        tx_check = _tx_deny
+
+    sender = cfg.get("sender") or cfg.get("name") or channel_id
+
+    CHANNELS_BY_FREQ[freq] = {
+        "id": channel_id,
+        **cfg,
+        "sender": sender,
+        "tx_policy": tx_policy,
+        "_tx_check": tx_check,
+    }
+
+ATC_TOWERS = airport_data["airports"]
+ATC_RESPONSES = atc_config["responses"]
+TRIGGER_PHRASES = atc_config["trigger_phrases"]
+HANDOFF_MESSAGES = atc_config.get("handoff_messages", {})
+ROLE_MAP = atc_config.get("role_map", {})
+REDIRECT_MESSAGES = atc_config.get("redirects", {})
+UNKNOWN_MESSAGES = atc_config.get("unknown", {})
+AUTO_CLEAR_RESPONSES = atc_config.get("auto_clear", {})
+SEQUENCING = atc_config.get("sequencing", {})
+OCCUPANCY = SEQUENCING.get("occupancy_seconds", {})
+HOLD_MESSAGES = SEQUENCING.get("holds", {})
+INVALID_RUNWAY_MESSAGES = atc_config.get("invalid_runway", {})
+EMERGENCY_TRIGGERS = atc_config.get("emergency_triggers", {})
+POSSIBLE_EMERGENCY_TRIGGERS = EMERGENCY_TRIGGERS.get("possible_emergency_triggers", [])
+
+# Kept pre-lowered: everything matching against these does so on
+# already-lowered message text.
+GROUND_TRIGGER_PHRASES = tuple(
+    p.lower() for p in TRIGGER_PHRASES.get("taxi", []) + TRIGGER_PHRASES.get("startup", [])
+)
+TOWER_TRIGGER_PHRASES = tuple(
+    p.lower() for p in TRIGGER_PHRASES.get("takeoff", []) + TRIGGER_PHRASES.get("landing", [])
+)
+STARTUP_TRIGGER_PHRASES = tuple(p.lower() for p in TRIGGER_PHRASES.get("startup", []))
+
+# Combine and normalize all emergency trigger phrases once at startup
+_EMERGENCY_TRIGGER_LIST = (
+    EMERGENCY_TRIGGERS.get("mayday", [])
+    + EMERGENCY_TRIGGERS.get("pan", [])
+    + EMERGENCY_TRIGGERS.get("generic", [])
+)
+EMERGENCY_TRIGGER_PHRASES = tuple(p.lower() for p in _EMERGENCY_TRIGGER_LIST)
+
+# Per-tier pre-lowered phrase tuples so the hot-path scan never calls
+# .lower() on a phrase and does one C-level substring pass per tier.
+EMERG_MAYDAY_L = tuple(p.lower() for p in EMERGENCY_TRIGGERS.get("mayday", []))
+EMERG_PAN_L = tuple(p.lower() for p in EMERGENCY_TRIGGERS.get("pan", []))
+EMERG_GENERIC_L = tuple(p.lower() for p in EMERGENCY_TRIGGERS.get("generic", []))
+POSSIBLE_EMERG_L = tuple(p.lower() for p in POSSIBLE_EMERGENCY_TRIGGERS)
+
+FLIGHT_PLAN_CONFIG = atc_config.get("flight_plan", {})
+FP_TRIGGERS = tuple(t.lower() for t in FLIGHT_PLAN_CONFIG.get("triggers", []))
+FP_RESPONSES = FLIGHT_PLAN_CONFIG.get("responses", [])
+
+def compile_phrase_re(phrases):
+    """
+    Compile a list of literal trigger phrases into one case-normalized
+    alternation regex, or None when the list is empty. One C-level
+    search then replaces a Python loop of substring checks.
+    """
+    lowered = [p.lower() for p in phrases if isinstance(p, str) and p]
+    if not lowered:
+        return None
+    # Longest phrase first: re alternation is leftmost-preferring, so this
+    # makes overlapping triggers match their most specific form.
+    lowered.sort(key=len, reverse=True)
+    return re.compile("|".join(map(re.escape, lowered)))
+
+_MAYDAY_RE = compile_phrase_re(EMERGENCY_TRIGGERS.get("mayday", []))
+_PAN_RE = compile_phrase_re(EMERGENCY_TRIGGERS.get("pan", []))
+_GENERIC_RE = compile_phrase_re(EMERGENCY_TRIGGERS.get("generic", []))
+_POSS_RE = compile_phrase_re(POSSIBLE_EMERGENCY_TRIGGERS)
+# Flattened safety-pass list as a single alternation: one linear scan
+# instead of one substring check per configured phrase.
+_EMERG_ANY_RE = compile_phrase_re(EMERGENCY_TRIGGER_PHRASES)
+_FP_RE = compile_phrase_re(FP_TRIGGERS)
+_heli_cfg = TRIGGER_PHRASES.get("helicopter", {})
+_HELI_RE = compile_phrase_re(_heli_cfg if isinstance(_heli_cfg, list) else [])
+
+# Category alternations for request classification in handle_atc:
+# one C-level scan per category instead of a phrase-by-phrase loop.
+_GROUND_RE = compile_phrase_re(GROUND_TRIGGER_PHRASES)
+_TOWER_RE = compile_phrase_re(TOWER_TRIGGER_PHRASES)
+_STARTUP_RE = compile_phrase_re(STARTUP_TRIGGER_PHRASES)
+
+# Per-action alternations for the main trigger loop, in config order so
+# action priority matches the JSON exactly as the old nested loop did.
+TRIGGER_ACTION_RES = [
+    (action, rx)
+    for action, phrases in TRIGGER_PHRASES.items()
+    if isinstance(phrases, list)
+    for rx in [compile_phrase_re(phrases)]
+    if rx is not None
+]
+
+# Most traffic contains no emergency phrase at all. A one-character-class
+# search over the first letters of every emergency/possible-emergency
+# phrase rejects routine messages before any full alternation scan runs.
+_EMERG_FIRST_CHARS = {
+    p[0]
+    for p in (
+        EMERG_MAYDAY_L + EMERG_PAN_L + EMERG_GENERIC_L
+        + POSSIBLE_EMERG_L + EMERGENCY_TRIGGER_PHRASES
+    )
+    if p
+}
+_EMERG_PREFILTER_RE = (
+    re.compile("[" + re.escape("".join(sorted(_EMERG_FIRST_CHARS))) + "]")
+    if _EMERG_FIRST_CHARS
+    else None
+)
+
+FP_HANDOFF_CONFIG = atc_config.get("flight_plan_departure_handoff", {})
+FP_HANDOFF_RESPONSES = FP_HANDOFF_CONFIG.get("responses", [])
+FP_HANDOFF_CHANCE = float(FP_HANDOFF_CONFIG.get("chance", 0.0))
+
+# Private RNG instance with bound methods: skips the module attribute
+# lookup that every random.<fn>() call pays in the weather tick and
+# response paths, and keeps our draws independent of anything that
+# reseeds the global generator. Shared across worker threads on purpose:
+# the GIL serializes each Mersenne step, the draws are cosmetic (template
+# picks), and a threading.local indirection would cost more per draw
+# than it saves.
+_rng = random.Random()
+_choice = _rng.choice
+_randint = _rng.randint
+_random = _rng.random
+
+_FIELD_RE = re.compile(r"\{(\w+)\}")
+
+class _CompiledTemplate:
+    """A config template pre-split into literal and field chunks.
+
+    format(**kw) joins the chunks directly, so the format string is
+    parsed once at load instead of on every rendered response.
+    """
+    __slots__ = ("raw", "literals", "fields")
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        parts = _FIELD_RE.split(raw)
+        self.literals = tuple(parts[0::2])
+        self.fields = tuple(parts[1::2])
+
+    def format(self, **kw) -> str:
+        fields = self.fields
+        if not fields:
+            return self.raw
+        literals = self.literals
+        # Most configured templates carry one or two placeholders; direct
+        # concatenation beats building and joining a chunk list for them.
+        if len(fields) == 1:
+            return literals[0] + str(kw[fields[0]]) + literals[1]
+        if len(fields) == 2:
+            return (
+                literals[0] + str(kw[fields[0]])
+                + literals[1] + str(kw[fields[1]])
+                + literals[2]
+            )
+        out = [literals[0]]
+        append = out.append
+        for i, name in enumerate(fields):
+            append(str(kw[name]))
+            append(literals[i + 1])
+        return "".join(out)
+
+def _freeze_pools(cfg):
+    """Compile a config dict's template lists into tuples of pre-split
+    templates (pools are immutable after load; tuples are smaller and
+    rendering skips format-string parsing)."""
+    if isinstance(cfg, dict):
+        return {
+            k: tuple(_CompiledTemplate(t) if isinstance(t, str) else t for t in v)
+            if isinstance(v, list) else v
+            for k, v in cfg.items()
+        }
+    return cfg
+
+ATC_RESPONSES = _freeze_pools(ATC_RESPONSES)
+HANDOFF_MESSAGES = _freeze_pools(HANDOFF_MESSAGES)
+REDIRECT_MESSAGES = _freeze_pools(REDIRECT_MESSAGES)
+UNKNOWN_MESSAGES = _freeze_pools(UNKNOWN_MESSAGES)
+AUTO_CLEAR_RESPONSES = _freeze_pools(AUTO_CLEAR_RESPONSES)
+HOLD_MESSAGES = _freeze_pools(HOLD_MESSAGES)
+INVALID_RUNWAY_MESSAGES = _freeze_pools(INVALID_RUNWAY_MESSAGES)
+FP_RESPONSES = tuple(_CompiledTemplate(t) for t in FP_RESPONSES)
+# Partitioned once: templates naming {DESTINATION} are only usable when a
+# destination was parsed, so the per-message template filter is a lookup.
+FP_RESPONSES_NO_DEST = tuple(t for t in FP_RESPONSES if "DESTINATION" not in t.fields)
+FP_HANDOFF_RESPONSES = tuple(_CompiledTemplate(t) for t in FP_HANDOFF_RESPONSES)
+
+# The emergency pools are consulted on every emergency message; bind them
+# once here instead of re-keying the frozen dicts inside handle_atc.
+_ACK_MAYDAY = ATC_RESPONSES.get("emergency_ack_mayday", ())
+_ACK_PAN = ATC_RESPONSES.get("emergency_ack_pan", ())
+_ACK_GENERIC = ATC_RESPONSES.get("emergency_ack_generic", ())
+_HOLD_EMERG = HOLD_MESSAGES.get("emergency_hold_traffic", ())
+
+ZONE_DEFAULTS = WEATHER_CONFIG.get("defaults", {})
+ZONE_CONFIGS = WEATHER_CONFIG.get("zones", {})
+class CondCfg:
+    """
+    Frozen per-condition view of weather.json, with __slots__ so the hot
+    weather paths use attribute loads instead of chained dict.gets.
+    """
+    __slots__ = ("visibility", "style", "description", "transition", "time_bias")
+
+    def __init__(self, cfg: dict):
+        self.visibility = cfg.get("visibility", "GOOD")
+        self.style = cfg.get("style", "VFR")
+        self.description = cfg.get("description")
+        self.transition = tuple(cfg.get("transition", []))
+        self.time_bias = cfg.get("time_bias", {})
+
+CONDITION_CONFIGS = {
+    name: CondCfg(cfg) for name, cfg in WEATHER_CONFIG.get("conditions", {}).items()
+}
+WEATHER_ZONES: dict[str, list[str]] = {}
+WEATHER_STATE: dict[str, dict] = {}
+
+SERVER_INSTANCE_ID = str(uuid.uuid4())
+_INSTANCE_ID_JSON = json.dumps(SERVER_INSTANCE_ID)
+
+def _msg_json(mid: int, text: str, sender: str) -> str:
+    """
+    Serialize one message to its wire fragment at append time. Buffers
+    hold these compact strings instead of three-key dicts, and /fetch
+    joins fragments instead of re-encoding every message per poll.
+    """
+    return json.dumps(
+        {"id": mid, "text": text, "sender": sender},
+        separators=(",", ":"),
+    )
+
+# Per-frequency storage, kept in least-recently-touched order so expiry
+# can stop at the first live entry instead of sweeping everything.
+channels: OrderedDict[int, "Channel"] = OrderedDict()
+
+RUNWAY_STATE: dict[str, dict[str, "RunwayState"]] = {}
+RUNWAY_END_TO_PHYSICAL: dict[str, dict[str, str]] = {}   # ICAO -> { "27L": "RWY_L", ... }
+VALID_ENDS_BY_ACTION: dict[str, dict[str, frozenset[str]]] = {}
+SORTED_TAXI_ENDS: dict[str, tuple[str, ...]] = {}        # ICAO -> ("09", "27L", ...)
+
+HELIPADS_BY_AIRPORT: dict[str, dict[str, dict]] = {}     # ICAO -> { "H1": {...}, "HOSP": {...} }
+HELIPAD_LIMITS: dict[str, dict[str, int]] = {}           # ICAO -> { "H1": 1, "HOSP": 2, ... }
+HELIPADS_ORDERED: dict[str, tuple[tuple[str, int], ...]] = {}  # ICAO -> (("H1", 1), ...)
+HELIPAD_OCCUPANCY: dict[str, dict[str, int]] = {}        # ICAO -> { "H1": 0, "HOSP": 0, ... }
+
+
+# Airport+callsign -> timestamp (or just flag) for active flight plans
+ACTIVE_FLIGHT_PLANS: dict[tuple[str, str], float] = {}
+# (airport_code, CALLSIGN) -> {"origin": ..., "destination": ...}
+FLIGHT_PLAN_ROUTES: dict[tuple[str, str], dict] = {}
+FLIGHT_PLAN_TTL_SECONDS = 60 * 60
+
+ACTIVE_EMERGENCIES: dict[tuple[str, str], dict] = {}
+EMERGENCY_TTL_SECONDS = 5 * 60  # auto-expire after 5 minutes
+
+# One shared min-heap of (expires_at, kind, key) covering every TTL'd
+# dict, so a single pop-until-future pass replaces per-dict sweeps.
+# Entries may go stale when a key is refreshed or cleared early; the pop
+# path re-validates against the owning dict before deleting.
+#
+# All deadlines here (and the timestamps in the dicts they guard, e.g.
+# ACTIVE_FLIGHT_PLANS) are wall-clock floats from current_time(). Keep
+# it that way: mixing time.monotonic()/monotonic_ns() into one producer
+# would make its entries incomparable with the rest of the heap.
+_EXPIRY_HEAP: list[tuple[float, str, tuple[str, str]]] = []
+
+_EXPIRY_KIND_EMERGENCY = "emergency"
+_EXPIRY_KIND_FLIGHT_PLAN = "flight_plan"
+_EXPIRY_KIND_HELIPAD = "helipad"
+
+DEFAULT_FREQUENCY = 16
+
+# Matched against already-lowercased text, so no IGNORECASE engine overhead
+RUNWAY_RE = re.compile(r"\b(?:runway|rwy)\s*([0-3]?\d)\s*([lrc])?\b")
+PILOT_ASSIGNED_RUNWAY = {}
+PILOT_ASSIGNED_HELIPAD: dict[tuple[str, str], str] = {}  # (ICAO, CALLSIGN) -> helipad id
+PILOT_HELIPAD_LAST_ACTIVITY: dict[tuple[str, str], float] = {}
+HELIPAD_TTL_SECONDS = 1800  # e.g. 30 minutes; tune as you like
+
+
+ROUTE_PATTERN = re.compile(
+    r"\b([A-Z0-9]{3,4})\s*(?:>|to|-|–)\s*([A-Z0-9]{3,4})\b",
+    re.IGNORECASE
+)
+DEST_ONLY_PATTERN = re.compile(
+    r"\bto\s+([A-Z0-9]{3,4})\b",
+    re.IGNORECASE,
+)
+
+MAX_MESSAGES = 100  # per-channel ring buffer size (deque maxlen)
+FREQUENCY_EXPIRE_SECONDS = 30 * 60  # 30 minutes
+
+SL_DAY_SECONDS = 4 * 60 * 60  # 4 hours = 14,400 seconds
+
+@app.before_request
+def _cache_request_time():
+    # One wall-clock read per request; helpers pick it up via current_time()
+    g.now = time.time()
+
+def current_time() -> float:
+    """
+    Wall-clock time, cached per request so the handlers and their helpers
+    don't each make their own time.time() call.
+    """
+    try:
+        return g.now
+    except (RuntimeError, AttributeError):
+        # Outside a request context (startup, background work, tests)
+        return time.time()
+
+def get_sl_cycle_fraction(now=None):
+    """
+    Returns a float from 0.0–1.0 representing
+    where we are in SL's 4-hour day cycle.
+    """
+    if now is None:
+        now = current_time()
+
+    return (now % SL_DAY_SECONDS) / SL_DAY_SECONDS
+
+def get_sl_day_window(now=None):
+    frac = get_sl_cycle_fraction(now)
+
+    if frac < 0.25:
+        return "MORNING"
+    elif frac < 0.50:
+        return "AFTERNOON"
+    elif frac < 0.75:
+        return "EVENING"
+    else:
+        return "NIGHT"
+
+def get_slt_now():
+    return datetime.now(ZoneInfo("America/Los_Angeles"))
+
+def get_slt_hour():
+    return get_slt_now().hour
+
+class Channel:
+    """
+    Per-frequency message buffer. __slots__ keeps these compact and makes
+    attribute access cheaper than the dict-of-keys wrapper it replaces;
+    the deque(maxlen=...) is already a C-level ring buffer.
+    """
+    __slots__ = ("next_id", "messages", "last_active", "lock", "epoch")
+
+    def __init__(self, now: float):
+        self.next_id = 1
+        self.messages = deque(maxlen=MAX_MESSAGES)
+        self.last_active = now
+        # Creation timestamp, folded into /fetch ETags: ids restart at 1
+        # when an expired frequency is recreated, and the epoch keeps a
+        # recreated channel's tags distinct from the old channel's.
+        self.epoch = now
+        # Guards the append/next_id pair: the sim ticker appends queued
+        # clearances from its own thread, and separate frequencies should
+        # not have to serialize on anything wider than their own buffer.
+        self.lock = threading.Lock()
+
+def get_channel(freq: int) -> Channel:
+    now = current_time()
+
+    channel = channels.get(freq)
+    if channel is None:
+        # setdefault is a single C call: if another request thread
+        # created this frequency between the get and here, adopt its
+        # Channel instead of clobbering it with a second buffer/lock.
+        channel = channels.setdefault(freq, Channel(now))
+    else:
+        # Keep most-recently-touched channels at the tail for O(1) expiry
+        channels.move_to_end(freq)
+
+    channel.last_active = now
+    return channel
+
+def can_transmit_on_frequency(freq: int, sender_uuid: str | None) -> bool:
+    channel = CHANNELS_BY_FREQ.get(freq)
+    if channel is None:
+        # Not a dedicated channel – treat as normal ATC / regular freq
+        return True
+
+    # Policy mode was resolved into a single callable at config load
+    return channel["_tx_check"](sender_uuid)
+
+# -------------------------------------------------------------------
+# Helicopter detection (JSON-driven)
+# -------------------------------------------------------------------
+def is_helicopter_request(request_text: str, callsign: str) -> bool:
+    text = request_text or ""
+    if not text.islower():
+        text = text.lower()
+    cs = (callsign or "").lower()
+
+    if _HELI_RE and _HELI_RE.search(text):
+        return True
+
+    # Optional callsign-based detection
+    if cs.startswith(("heli", "helo", "h-")):
+        return True
+
+    return False
+
+def choose_helicopter_response(airport_code: str, action: str, callsign: str, helipad: str | None = None) -> str:
+    airport_cfg = ATC_TOWERS.get(airport_code, {})
+    resp_cfg = ATC_RESPONSES.get("responses", {})
+
+    key = f"helicopter_{action}"
+    candidates = ATC_RESPONSES.get(key, [])
+
+    def _format(template: str) -> str:
+        return template.format(
+            CALLSIGN=callsign,
+            AIRPORT=airport_code,
+            HELIPAD=helipad or "",
+        )
+
+    if candidates:
+        template = _choice(candidates)
+        return _format(template)
+
+    # Fallback: generic non-runway phrasing
+    generic_key = f"{action}"
+    fallback = ATC_RESPONSES.get(generic_key, [])
+
+    if fallback:
+        template = _choice(fallback)
+        return _format(template)
+
+    # Absolute fallback (never mentions runway)
+    if action == "takeoff":
+        return f"{callsign}, cleared for departure."
+    if action == "landing":
+        return f"{callsign}, cleared to land."
+
+    return None
+
+
+#------------------------------------
+# EMERGENCY HELPERS
+#------------------------------------
+EMERGENCY_TYPE_NONE = "none"
+EMERGENCY_TYPE_MAYDAY = "mayday"
+EMERGENCY_TYPE_PAN = "pan"
+EMERGENCY_TYPE_GENERIC = "generic"
+
+@functools.lru_cache(maxsize=1024)
+def detect_emergency_type(text: str) -> str:
+    """
+    Detect emergency type based purely on JSON-defined trigger phrases.
+    Priority order:
+      MAYDAY > PAN > GENERIC
+    """
+    if not text:
+        return EMERGENCY_TYPE_NONE
+
+    # Callers on the hot path pass already-lowered text; avoid re-copying it.
+    t = text if text.islower() else text.lower()
+
+    # Prefilter: no emergency first-letter bytes present -> nothing can match
+    if _EMERG_PREFILTER_RE and not _EMERG_PREFILTER_RE.search(t):
+        return EMERGENCY_TYPE_NONE
+
+    # One compiled-alternation search per tier; MAYDAY has highest priority.
+    if _MAYDAY_RE and _MAYDAY_RE.search(t):
+        return EMERGENCY_TYPE_MAYDAY
+
+    if _PAN_RE and _PAN_RE.search(t):
+        return EMERGENCY_TYPE_PAN
+
+    if _GENERIC_RE and _GENERIC_RE.search(t):
+        return EMERGENCY_TYPE_GENERIC
+
+    return EMERGENCY_TYPE_NONE
+
+@functools.lru_cache(maxsize=1024)
+def sounds_like_possible_emergency(text: str) -> bool:
+    if not text:
+        return False
+
+    t = text if text.islower() else text.lower()
+
+    if _EMERG_PREFILTER_RE and not _EMERG_PREFILTER_RE.search(t):
+        return False
+
+    return bool(_POSS_RE and _POSS_RE.search(t))
+
+
+#------------------------------------
+# RUNWAY HELPERS
+#------------------------------------
+def build_runway_indexes():
+    for icao, tower in ATC_TOWERS.items():
+        icao_u = icao.upper()
+        tower["_icao"] = icao_u  # tag config so helpers can find ICAO quickly
+
+        # Map runway-end -> physical runway id
+        end_map: dict[str, str] = {}
+        for r in tower.get("runways", []):
+            phys = (r.get("physical_id") or r.get("id") or "").strip()
+            if not phys:
+                continue
+
+            # Uppercased end sets, reused by the physical-id fallback path
+            r["_landing_ends_u"] = frozenset(e.upper() for e in (r.get("landing_ends") or []))
+            r["_takeoff_ends_u"] = frozenset(e.upper() for e in (r.get("takeoff_ends") or []))
+
+            for end in r["_landing_ends_u"]:
+                end_map[end] = phys
+            for end in r["_takeoff_ends_u"]:
+                end_map[end] = phys
+
+        RUNWAY_END_TO_PHYSICAL[icao_u] = end_map
+
+        # Eagerly resolve the valid ends per action; the config is static
+        # after startup so there's nothing to compute lazily per request.
+        landings: set[str] = set()
+        if tower.get("landings"):
+            landings.update(x.upper() for x in tower["landings"])
+        else:
+            for r in tower.get("runways", []):
+                landings.update(x.upper() for x in r.get("landing_ends", []))
+
+        takeoffs: set[str] = set()
+        if tower.get("departures"):
+            takeoffs.update(x.upper() for x in tower["departures"])
+        else:
+            for r in tower.get("runways", []):
+                takeoffs.update(x.upper() for x in r.get("takeoff_ends", []))
+
+        takeoffs_f = frozenset(takeoffs)
+        VALID_ENDS_BY_ACTION[icao_u] = {
+            "landing": frozenset(landings),
+            "takeoff": takeoffs_f,
+            "taxi": takeoffs_f,  # taxi uses the takeoff ends
+        }
+        # Stable ordering for the random taxi pick, sorted once here
+        # instead of on every unassigned taxi request.
+        SORTED_TAXI_ENDS[icao_u] = tuple(sorted(takeoffs_f))
+
+def build_helipad_indexes():
+    """
+    Build ICAO -> helipad config + occupancy maps from airport data.
+    """
+    HELIPADS_BY_AIRPORT.clear()
+    HELIPAD_OCCUPANCY.clear()
+    HELIPAD_LIMITS.clear()
+    HELIPADS_ORDERED.clear()
+
+    for icao, tower in ATC_TOWERS.items():
+        icao_u = icao.upper()
+        pads = tower.get("helipads", [])
+        if not pads:
+            continue
+
+        pad_map: dict[str, dict] = {}
+        occ_map: dict[str, int] = {}
+
+        for pad in pads:
+            pid = (pad.get("id") or "").upper().strip()
+            if not pid:
+                continue
+
+            pad_map[pid] = pad
+            occ_map[pid] = 0  # start empty
+
+        if pad_map:
+            HELIPADS_BY_AIRPORT[icao_u] = pad_map
+            HELIPAD_OCCUPANCY[icao_u] = occ_map
+            # Capacity limits resolved once here so assignment never has
+            # to re-read/convert max_simultaneous from the JSON config.
+            limits = {
+                pid: int(cfg.get("max_simultaneous", 1))
+                for pid, cfg in pad_map.items()
+            }
+            HELIPAD_LIMITS[icao_u] = limits
+            HELIPADS_ORDERED[icao_u] = tuple(limits.items())
+
+build_runway_indexes()
+build_helipad_indexes()
+
+def parse_requested_runway(request_text: str) -> str | None:
+    if not request_text:
+        return None
+
+    low = request_text if request_text.islower() else request_text.lower()
+
+    # Literal prefilter: without a "runway"/"rwy" token nothing can match,
+    # and the C-level substring find is far cheaper than the regex engine.
+    if "runway" not in low and "rwy" not in low:
+        return None
+
+    m = RUNWAY_RE.search(low)
+    if not m:
+        return None
+    num = int(m.group(1))
+    if num < 1 or num > 36:
+        return None
+    side = (m.group(2) or "").upper()
+    return f"{num:02d}{side}"
+
+def find_requested_helipad(airport_code: str, request_text: str) -> str | None:
+    """
+    Look for a helipad id (e.g. 'H1', 'HOSP') in the request text
+    that matches any configured helipad for this airport.
+    """
+    pads = HELIPADS_BY_AIRPORT.get(airport_code, {})
+    if not pads or not request_text:
+        return None
+
+    t = request_text.upper()
+    for pid in pads.keys():
+        if pid in t:
+            return pid
+
+    return None
+
+def _pick_helipad(ordered, occ_map, exclude=None):
+    """First pad (config order) with spare capacity, or None if all full."""
+    for pid, max_sim in ordered:
+        if pid != exclude and occ_map.get(pid, 0) < max_sim:
+            return pid
+    return None
+
+def assign_helipad(airport_code: str, requested_id: str | None, action: str):
+    """
+    Decide which helipad a helicopter should use at this airport.
+
+    For LANDING:
+      - Respect occupancy.
+      - Multi-pad: requested full -> divert to another; if all full -> "hold".
+      - Single-pad: if full -> "anywhere" (land anywhere on the field).
+
+    For TAKEOFF:
+      - Ignore occupancy. Never returns "hold" or "anywhere".
+      - Use requested pad if valid, otherwise first configured pad.
+
+    Returns:
+      (assigned_helipad_id, mode)
+
+    mode:
+      - None        -> normal helipad assignment
+      - "anywhere"  -> (LANDING only) single-pad, full
+      - "hold"      -> (LANDING only) multi-pad, all full
+    """
+    ordered = HELIPADS_ORDERED.get(airport_code)
+    if not ordered:
+        return None, None  # no helipads here
+
+    limits = HELIPAD_LIMITS[airport_code]
+    # Occupancy maps are fully populated for every pad airport by
+    # build_helipad_indexes, so no setdefault allocation is needed here.
+    occ_map = HELIPAD_OCCUPANCY[airport_code]
+    pad_count = len(ordered)
+
+    requested_id = (requested_id or "").upper() or None
+
+    # ----------------------------------------
+    # TAKEOFF: do NOT enforce occupancy
+    # ----------------------------------------
+    if action == "takeoff":
+        # prefer requested pad if it exists
+        if requested_id and requested_id in limits:
+            return requested_id, None
+
+        # otherwise just use first pad
+        return ordered[0][0], None
+
+    # ----------------------------------------
+    # LANDING: enforce occupancy/diversion rules
+    # ----------------------------------------
+
+    # 1) Requested specific pad
+    if requested_id and requested_id in limits:
+        if occ_map.get(requested_id, 0) < limits[requested_id]:
+            return requested_id, None
+
+        if pad_count == 1:
+            # single pad, full -> land anywhere
+            return None, "anywhere"
+
+        # multi-pad: try to divert
+        pid = _pick_helipad(ordered, occ_map, exclude=requested_id)
+        if pid:
+            return pid, None
+
+        # all pads full
+        return None, "hold"
+
+    # 2) No specific pad requested: pick any with space
+    pid = _pick_helipad(ordered, occ_map)
+    if pid:
+        return pid, None
+
+    # 3) None have space
+    if pad_count == 1:
+        return None, "anywhere"
+
+    return None, "hold"
+
+
+_EMPTY_FROZENSET: frozenset[str] = frozenset()
+
+def runway_ends_for_action(tower: dict, action: str) -> frozenset[str]:
+    """
+    Return valid runway END strings for the given action.
+    Precomputed per airport/action in build_runway_indexes.
+    """
+    by_action = VALID_ENDS_BY_ACTION.get(tower.get("_icao") or "")
+    if by_action is None:
+        return _EMPTY_FROZENSET
+    return by_action.get(action, _EMPTY_FROZENSET)
+
+def physical_id_for_runway_end(tower: dict, runway_end: str) -> str | None:
+    """
+    Map runway end (e.g. '27L') to runway physical_id using cached lookup.
+    """
+    runway_end = (runway_end or "").upper()
+    icao = (tower.get("_icao") or "").upper()
+
+    if icao:
+        hit = RUNWAY_END_TO_PHYSICAL.get(icao, {}).get(runway_end)
+        if hit:
+            return hit
+
+    # Fallback (in case runways are missing or caches not built)
+    for r in tower.get("runways", []):
+        landing_ends = r.get("_landing_ends_u") or frozenset(x.upper() for x in r.get("landing_ends", []))
+        takeoff_ends = r.get("_takeoff_ends_u") or frozenset(x.upper() for x in r.get("takeoff_ends", []))
+        if runway_end in landing_ends or runway_end in takeoff_ends:
+            return r.get("physical_id") or r.get("id")
+    return None
+
+def get_current_window(config, now=None):
+    if now is None:
+        now = get_slt_now()  # <-- SLT here
+
+    hour = now.hour
+    windows = config.get("time_windows", {})
+
+    for name, window in windows.items():
+        start = window["start_hour"]
+        end = window["end_hour"]
+
+        if start < end:
+            if start <= hour < end:
+                return name
+        else:
+            # Wraps past midnight (e.g. 21 → 05)
+            if hour >= start or hour < end:
+                return name
+
+    return "AFTERNOON"  # safe fallback
+
+def init_weather_zones():
+    for icao, ap in ATC_TOWERS.items():
+        zone_name = ap.get("weather_zone") or icao.upper()
+        ap["weather_zone"] = zone_name  # ensure it's set
+
+        WEATHER_ZONES.setdefault(zone_name, []).append(icao)
+
+        if zone_name not in WEATHER_STATE:
+            WEATHER_STATE[zone_name] = make_initial_weather_state(zone_name)
+
+# zone -> fully merged defaults; both source dicts are frozen after
+# startup so the merge is a pure function of the zone name.
+_ZONE_DEFAULTS_RESOLVED: dict[str, dict] = {}
+
+def get_zone_defaults(zone_name: str) -> dict:
+    cfg = _ZONE_DEFAULTS_RESOLVED.get(zone_name)
+    if cfg is None:
+        cfg = _ZONE_DEFAULTS_RESOLVED[zone_name] = {
+            **ZONE_DEFAULTS,
+            **ZONE_CONFIGS.get(zone_name, {}),
+        }
+    return cfg
+
+# zone -> (wind_min, wind_max, temp_lo, temp_hi, qnh_lo, qnh_hi), resolved
+# once so each weather tick steps its random walks without dict lookups.
+_ZONE_BOUNDS: dict[str, tuple[int, int, int, int, int, int]] = {}
+
+def get_zone_bounds(zone_name: str) -> tuple[int, int, int, int, int, int]:
+    bounds = _ZONE_BOUNDS.get(zone_name)
+    if bounds is None:
+        cfg = get_zone_defaults(zone_name)
+        base_temp = cfg.get("base_temp", 20)
+        temp_var  = cfg.get("temp_variation", 5)
+        qnh_mean  = cfg.get("qnh_mean", 1015)
+        qnh_var   = cfg.get("qnh_variation", 8)
+        bounds = _ZONE_BOUNDS[zone_name] = (
+            cfg.get("wind_min", 0),
+            cfg.get("wind_max", 20),
+            base_temp - temp_var,
+            base_temp + temp_var,
+            qnh_mean - qnh_var,
+            qnh_mean + qnh_var,
+        )
+    return bounds
+
+def make_initial_weather_state(zone_name: str) -> dict:
+    cfg = get_zone_defaults(zone_name)
+
+    base_temp = cfg.get("base_temp", 20)
+    temp_var  = cfg.get("temp_variation", 5)
+    wind_min  = cfg.get("wind_min", 0)
+    wind_max  = cfg.get("wind_max", 20)
+    qnh_mean  = cfg.get("qnh_mean", 1015)
+    qnh_var   = cfg.get("qnh_variation", 8)
+    favored   = cfg.get("favored_conditions", ["CLEAR", "FEW", "BKN"])
+
+    condition = _choice(favored)
+    cond_cfg = CONDITION_CONFIGS.get(condition)
+
+    return {
+        "condition": condition,
+        "wind_dir": _randint(0, 359),
+        "wind_speed": _randint(wind_min, wind_max),
+        "visibility": cond_cfg.visibility if cond_cfg else "GOOD",
+        "style": cond_cfg.style if cond_cfg else "VFR",
+        "temp": base_temp + _randint(-temp_var, temp_var),
+        "qnh": qnh_mean + _randint(-qnh_var, qnh_var),
+        "last_update": current_time(),
+        "zone": zone_name
+    }
+
+init_weather_zones()
+
+def step_value(value, step, min_v, max_v):
+    return max(min_v, min(max_v, value + _randint(-step, step)))
+
+def pick_next_condition(config, zone_name, current_condition=None, now=None):
+    zones = config["zones"]
+    cond_def = config["conditions"]
+
+    zone = zones[zone_name]
+    time_window = get_sl_day_window()  # e.g. "AFTERNOON"
+
+    # 1) Decide candidate conditions
+    if current_condition:
+        # Use transitions from the current condition
+        base = cond_def[current_condition]
+        transitions = base.get("transition", [])
+
+        # Include "stay the same" as an implicit option
+        candidates = [(current_condition, 1.0)]
+        for t in transitions:
+            candidates.append((t["to"], t["chance"]))
+    else:
+        # No current condition: pick from the zone's favored list
+        conds = zone.get("favored_conditions") or config["defaults"]["favored_conditions"]
+        candidates = [(c, 1.0) for c in conds]
+
+    # 2) Apply time-of-day bias
+    weighted = []
+    for name, base_chance in candidates:
+        cdef = cond_def.get(name, {})
+        time_bias = 1.0
+
+        if time_window:
+            bias_map = cdef.get("time_bias", {})
+            time_bias = bias_map.get(time_window, 1.0)
+
+        weight = base_chance * time_bias
+        if weight > 0:
+            weighted.append((name, weight))
+
+    # Safety: if everything got zero’d somehow
+    if not weighted:
+        # fallback to current_condition or CLEAR
+        return current_condition or "CLEAR"
+
+    # 3) Random choice using weights
+    total = sum(w for _, w in weighted)
+    r = _random() * total
+    upto = 0.0
+
+    for name, w in weighted:
+        upto += w
+        if r <= upto:
+            return name
+
+    # Fallback
+    return weighted[-1][0]
+
+def update_zone_weather(state: dict):
+    zone_name = state["zone"]
+    wind_min, wind_max, temp_lo, temp_hi, qnh_lo, qnh_hi = get_zone_bounds(zone_name)
+
+    # Wind random walk within zone range
+    state["wind_dir"] = (state["wind_dir"] + _randint(-10, 10)) % 360
+    state["wind_speed"] = step_value(state["wind_speed"], 2, wind_min, wind_max)
+
+    # Temp drifts toward base_temp-ish area
+    state["temp"] = step_value(state["temp"], 1, temp_lo, temp_hi)
+
+    # Pressure wiggle
+    state["qnh"] = step_value(state["qnh"], 1, qnh_lo, qnh_hi)
+
+    # Condition transition using config
+    current_cond = state.get("condition")
+    new_cond = pick_next_condition(WEATHER_CONFIG, zone_name, current_cond)
+    state["condition"] = new_cond
+
+    cond_cfg = CONDITION_CONFIGS.get(new_cond)
+    if cond_cfg:
+        state["visibility"] = cond_cfg.visibility
+        state["style"] = cond_cfg.style
+
+    state["last_update"] = current_time()
+    # Invalidates the per-airport METAR/report string caches below.
+    state["version"] = state.get("version", 0) + 1
+
+def get_weather_for_airport(icao: str) -> dict | None:
+    """
+    Return current weather state for an airport's zone.
+    Uses ATC_TOWERS as the source of truth (flat dict: ICAO -> config).
+    Zones and their states are fully built by init_weather_zones() at startup.
+    """
+    ap = ATC_TOWERS.get(icao.upper())
+    if not ap:
+        # Truly unknown airport
+        return None
+
+    # init_weather_zones() guarantees every airport has a zone with state,
+    # so the hot path is just two dict lookups.
+    return WEATHER_STATE[ap["weather_zone"]]
+
+_METAR_TS_CACHE: tuple[int, str] = (-1, "")
+
+def _metar_timestamp() -> str:
+    """
+    DDHHMMZ group in UTC, cached per minute — METAR granularity is
+    minutes, so no need to re-run strftime on every weather fetch.
+    """
+    global _METAR_TS_CACHE
+    minute = int(current_time()) // 60
+    if minute != _METAR_TS_CACHE[0]:
+        tm = time.gmtime(minute * 60)
+        _METAR_TS_CACHE = (minute, f"{tm.tm_mday:02d}{tm.tm_hour:02d}{tm.tm_min:02d}Z")
+    return _METAR_TS_CACHE[1]
+
+def format_metar_from_state(icao: str, state: dict | None) -> str | None:
+    """
+    Build a pseudo-METAR string from your simulated weather state.
+
+    Uses keys:
+      condition (e.g. "FEW")
+      visibility ("GOOD", "MODERATE", "POOR"...)
+      style ("VFR", "IFR"...)
+      wind_dir (degrees)
+      wind_speed (knots)
+      temp (°C)
+      qnh (hPa)
+    """
+    if not state:
+        return None
+
+    # Time: DDHHMMZ in UTC (cached per minute)
+    time_str = _metar_timestamp()
+
+    # Wind
+    try:
+        wind_dir = int(state.get("wind_dir") or 0)
+    except (TypeError, ValueError):
+        wind_dir = 0
+
+    try:
+        wind_speed = int(state.get("wind_speed") or 0)
+    except (TypeError, ValueError):
+        wind_speed = 0
+
+    if wind_speed <= 1:
+        wind_str = "00000KT"
+    else:
+        wind_str = f"{wind_dir:03d}{wind_speed:02d}KT"
+
+    # Visibility buckets from your "visibility" string
+    vis_code = (state.get("visibility") or "").upper()
+    if vis_code == "GOOD":
+        vis_str = "10SM"
+    elif vis_code in ("MODERATE", "MOD"):
+        vis_str = "6SM"
+    elif vis_code in ("POOR", "LOW"):
+        vis_str = "3SM"
+    else:
+        vis_str = "10SM"
+
+    # Clouds from your "condition" string
+    cond = (state.get("condition") or "").upper()
+
+    wx_str = ""
+    clouds_str = ""
+
+    if cond == "CLEAR":
+        clouds_str = "SKC"
+
+    elif cond == "FEW":
+        clouds_str = "FEW020"
+
+    elif cond == "BKN":
+        clouds_str = "BKN030"
+
+    elif cond == "OVC":
+        clouds_str = "OVC015"
+
+    elif cond == "RAIN":
+        wx_str = "RA"
+        clouds_str = "BKN025"
+
+    elif cond == "STORM":
+        wx_str = "TSRA"
+        clouds_str = "BKN030CB"
+
+    elif cond == "MONSOON":
+        wx_str = "+RA"
+        clouds_str = "OVC020"
+
+    elif cond == "SNOW":
+        wx_str = "SN"
+        clouds_str = "OVC020"
+
+    elif cond == "MIST":
+        wx_str = "BR"
+        clouds_str = "FEW005"
+
+    elif cond == "FOG":
+        wx_str = "FG"
+        clouds_str = "OVC003"
+
+    elif cond == "HAZE":
+        wx_str = "HZ"
+        clouds_str = "NSC"
+
+    elif cond == "DUST":
+        wx_str = "DU"
+        clouds_str = "NSC"
+
+    else:
+        clouds_str = "NSC"
+
+
+    # Temperature / (fake) dewpoint
+    try:
+        temp = int(state.get("temp"))
+    except (TypeError, ValueError):
+        temp = 18  # safe default
+
+    dew = temp - 6  # simple fake dewpoint; adjust if you like
+
+    def fmt_t(t: int) -> str:
+        if t < 0:
+            return f"M{abs(t):02d}"
+        return f"{t:02d}"
+
+    temp_str = fmt_t(temp)
+    dew_str = fmt_t(int(dew))
+
+    # QNH
+    try:
+        qnh = int(state.get("qnh"))
+    except (TypeError, ValueError):
+        qnh = 1015
+    qnh_str = f"Q{qnh:04d}"
+
+    # Flight rules
+    style = (state.get("style") or "").upper()
+    if style not in ("VFR", "MVFR", "IFR", "LIFR"):
+        style = "VFR"
+
+    # Final body: ICAO DDHHMMZ ...
+    parts = [icao, time_str, wind_str, vis_str]
+
+    # Insert weather group if present (RA/TSRA/FG/etc.)
+    if wx_str:
+        parts.append(wx_str)
+
+    parts.append(clouds_str)
+    parts.append(f"{temp_str}/{dew_str}")
+    parts.append(qnh_str)
+    parts.append(style)
+
+    return " ".join(parts)
+
+
+def format_weather_report(icao: str) -> str | None:
+    """
+    Build a human-friendly weather string for an airport using the
+    current zone state and the condition definitions from weather.json.
+    """
+    icao = icao.upper()
+    state = get_weather_for_airport(icao)
+    if not state:
+        return None
+
+    cond = state["condition"]
+    cond_cfg = CONDITION_CONFIGS.get(cond)
+    desc = (cond_cfg.description if cond_cfg else None) or cond.lower()
+    vis = state.get("visibility", "GOOD").lower()
+    style = state.get("style", "VFR")
+
+    return (
+        f"{icao} weather: winds {state['wind_dir']:03.0f} at {state['wind_speed']} knots, "
+        f"visibility {vis}, {desc}, temperature {state['temp']}C, "
+        f"QNH {state['qnh']}, flight conditions {style}."
+    )
+
+
+# Rendered weather strings are pure functions of (zone state version,
+# METAR minute), so cache them per airport and re-render only when the
+# sim advanced or the timestamp group rolled over.
+_METAR_STR_CACHE: dict[str, tuple[int, int, str]] = {}
+_REPORT_STR_CACHE: dict[str, tuple[int, str]] = {}
+
+def metar_for_airport(icao: str, state: dict) -> str | None:
+    ver = state.get("version", 0)
+    minute = int(current_time()) // 60
+    cached = _METAR_STR_CACHE.get(icao)
+    if cached is not None and cached[0] == ver and cached[1] == minute:
+        return cached[2]
+    body = format_metar_from_state(icao, state)
+    if body is not None:
+        _METAR_STR_CACHE[icao] = (ver, minute, body)
+    return body
+
+def weather_report_for_airport(icao: str, state: dict) -> str | None:
+    ver = state.get("version", 0)
+    cached = _REPORT_STR_CACHE.get(icao)
+    if cached is not None and cached[0] == ver:
+        return cached[1]
+    report = format_weather_report(icao)
+    if report is not None:
+        _REPORT_STR_CACHE[icao] = (ver, report)
+    return report
+
+
+WEATHER_UPDATE_INTERVAL = 10 * 60  # 10 minutes
+
+# Keys copied verbatim from zone state into the /weather payload
+_WEATHER_KEYS = ("zone", "condition", "visibility", "style", "wind_dir", "wind_speed", "temp", "qnh")
+
+# Earliest moment any zone needs another tick; until then the whole
+# per-request sweep over WEATHER_STATE is skipped.
+_NEXT_WEATHER_UPDATE = 0.0
+
+def update_all_weather():
+    global _NEXT_WEATHER_UPDATE
+
+    now = current_time()
+    if now < _NEXT_WEATHER_UPDATE:
+        return
+
+    next_due = now + WEATHER_UPDATE_INTERVAL
+    for zone_name, state in WEATHER_STATE.items():
+        due = state.get("last_update", 0) + WEATHER_UPDATE_INTERVAL
+        if now >= due:
+            update_zone_weather(state)
+            due = state["last_update"] + WEATHER_UPDATE_INTERVAL
+        if due < next_due:
+            next_due = due
+
+    _NEXT_WEATHER_UPDATE = next_due
+
+def record_emergency(airport_code: str, callsign: str, emergency_type: str, runway: str | None = None):
+    """
+    Store an active emergency for this airport + callsign.
+    """
+    # Callers pass codes already uppercased at ingest (normalize_atc_message)
+    key = (airport_code, callsign)
+    now = current_time()
+    ACTIVE_EMERGENCIES[key] = {
+        "type": emergency_type,
+        "runway": runway,
+        "started_at": now,
+    }
+    heapq.heappush(_EXPIRY_HEAP, (now + EMERGENCY_TTL_SECONDS, _EXPIRY_KIND_EMERGENCY, key))
+
+
+def get_active_emergency(airport_code: str, callsign: str) -> dict | None:
+    return ACTIVE_EMERGENCIES.get((airport_code, callsign))
+
+
+def clear_emergency(airport_code: str, callsign: str):
+    ACTIVE_EMERGENCIES.pop((airport_code, callsign), None)
+
+HOUSEKEEP_MIN_INTERVAL = 15  # seconds
+_NEXT_HOUSEKEEP = 0.0
+
+def process_expiries(now: float | None = None):
+    """
+    Pop everything due from the shared expiry heap and evict it from the
+    owning dict. One pass covers emergencies, flight plans and helipad
+    assignments; cost is O(actually expired), not O(live entries).
+    """
+    global _HELIPADS_DIRTY
+
+    if now is None:
+        now = current_time()
+
+    while _EXPIRY_HEAP and _EXPIRY_HEAP[0][0] <= now:
+        _, kind, key = heapq.heappop(_EXPIRY_HEAP)
+
+        # Re-check the owning dict: the key may have been cleared or
+        # refreshed (a refresh pushes its own heap entry) since queueing.
+        if kind == _EXPIRY_KIND_EMERGENCY:
+            info = ACTIVE_EMERGENCIES.get(key)
+            if info and now - info.get("started_at", now) > EMERGENCY_TTL_SECONDS:
+                ACTIVE_EMERGENCIES.pop(key, None)
+
+        elif kind == _EXPIRY_KIND_FLIGHT_PLAN:
+            ts = ACTIVE_FLIGHT_PLANS.get(key)
+            if ts is not None and now - ts > FLIGHT_PLAN_TTL_SECONDS:
+                # key is (airport_code, CALLSIGN)
+                ACTIVE_FLIGHT_PLANS.pop(key, None)
+                FLIGHT_PLAN_ROUTES.pop(key, None)
+
+        elif kind == _EXPIRY_KIND_HELIPAD:
+            ts = PILOT_HELIPAD_LAST_ACTIVITY.get(key)
+            if ts is not None and now - ts > HELIPAD_TTL_SECONDS:
+                PILOT_HELIPAD_LAST_ACTIVITY.pop(key, None)
+                PILOT_ASSIGNED_HELIPAD.pop(key, None)
+                _HELIPADS_DIRTY = True
+
+def cleanup_expired_frequencies(now: float | None = None):
+    """Expire inactive frequency buffers to keep memory bounded."""
+    if now is None:
+        now = current_time()
+
+    # channels is LRU-ordered (get_channel moves touched entries to the
+    # tail), so we only need to pop from the head until we hit a live one.
+    while channels:
+        freq, data = next(iter(channels.items()))
+        if now - data.last_active <= FREQUENCY_EXPIRE_SECONDS:
+            break
+        channels.popitem(last=False)
+
+# Set whenever pilot->helipad assignments change (landing, takeoff or
+# TTL expiry); occupancy is only rebuilt when something actually moved.
+_HELIPADS_DIRTY = True
+
+def rebuild_helipad_occupancy():
+    """
+    Rebuild helipad occupancy from the current pilot assignments.
+    No-op unless an assignment changed since the last rebuild.
+    """
+    global _HELIPADS_DIRTY
+
+    if not _HELIPADS_DIRTY:
+        return
+
+    # Cleared up front so an assignment landing mid-rebuild re-dirties
+    # the flag and triggers a fresh pass; restored on failure so an
+    # aborted rebuild (the ticker swallows exceptions) is retried on the
+    # next tick instead of leaving occupancy zeroed/partial. Net effect:
+    # the flag only stays cleared after a completed rebuild.
+    _HELIPADS_DIRTY = False
+    try:
+        # 1) Reset all helipad occupancy to 0
+        for occ_map in HELIPAD_OCCUPANCY.values():
+            for pad_id in occ_map:
+                occ_map[pad_id] = 0
+
+        # 2) Rebuild occupancy from the live pilot assignments. Snapshot
+        # the dict: request threads insert/pop assignments while this
+        # runs on the ticker thread, and iterating the live dict would
+        # raise "dictionary changed size during iteration".
+        for (icao, callsign), pad_id in list(PILOT_ASSIGNED_HELIPAD.items()):
+            occ_map = HELIPAD_OCCUPANCY.get(icao)
+            if occ_map is not None and pad_id in occ_map:
+                occ_map[pad_id] += 1
+    except BaseException:
+        _HELIPADS_DIRTY = True
+        raise
+
+
+def housekeeping(force: bool = False):
+    """
+    Throttled cleanup to keep request handlers light.
+    """
+    global _NEXT_HOUSEKEEP
+    now = current_time()
+
+    if not force and now < _NEXT_HOUSEKEEP:
+        return
+    _NEXT_HOUSEKEEP = now + HOUSEKEEP_MIN_INTERVAL
+
+    cleanup_expired_frequencies(now)
+    process_expiries(now)
+    rebuild_helipad_occupancy()
+
+def _cap(text: str) -> str:
+    """Uppercase the first character; no copy when it already is."""
+    if not text or text[0].isupper():
+        return text
+    return text[0].upper() + text[1:]
+
+@functools.lru_cache(maxsize=4096)
+def format_freq(freq: int) -> str:
+    if freq < 1000:
+        return f"CH {freq}"
+    mhz = freq // 1000
+    khz = freq % 1000
+    khz_str = f"{khz:03d}"
+    return f"{mhz}.{khz_str} MHz"
+
+class TowerRT:
+    """Per-airport runtime facts resolved once from config at load time.
+
+    Saves the tower/ground frequency dict-get chains, the sender-name
+    fallbacks and the format_freq calls that handle_atc otherwise repeats
+    on every message.
+    """
+    __slots__ = (
+        "tower_freq", "ground_freq",
+        "tower_freq_str", "ground_freq_str",
+        "tower_sender", "ground_sender",
+        "single_freq",
+    )
+
+    def __init__(self, icao: str, cfg: dict):
+        self.tower_freq = cfg.get("tower_frequency", cfg.get("frequency", DEFAULT_FREQUENCY))
+        self.ground_freq = cfg.get("ground_frequency", self.tower_freq)
+        self.tower_freq_str = format_freq(self.tower_freq)
+        self.ground_freq_str = format_freq(self.ground_freq)
+        self.tower_sender = cfg.get("tower_sender", f"{icao} Tower")
+        self.ground_sender = cfg.get("ground_sender", f"{icao} Ground")
+        self.single_freq = self.ground_freq == self.tower_freq
+
+TOWER_RT: dict[str, TowerRT] = {
+    icao: TowerRT(icao, cfg) for icao, cfg in ATC_TOWERS.items()
+}
+
+class RunwayState:
+    """Sequencing state for one physical runway (or runway end)."""
+    __slots__ = ("active", "queue", "expires_at")
+
+    def __init__(self):
+        self.active = None           # dict or None
+        self.queue = deque()         # waiting aircraft
+        self.expires_at = 0
+
+def get_runway_state(airport: str, runway: str) -> RunwayState:
+    airport_state = RUNWAY_STATE.setdefault(airport, {})
+    state = airport_state.get(runway)
+    if state is None:
+        state = airport_state[runway] = RunwayState()
+    return state
+
+def runway_active(state: RunwayState) -> bool:
+    return state.active is not None and current_time() < state.expires_at
+
+def set_runway_active(state: RunwayState, entry: dict, seconds: float):
+    state.active = entry
+    state.expires_at = current_time() + seconds
+
+def clear_runway(state: RunwayState):
+    state.active = None
+    state.expires_at = 0
+
+def choose_runway_for_action(tower_cfg, action):
+    """
+    Select a runway and end for the given action ("landing" or "takeoff").
+
+    Returns:
+        (logical_runway_key, runway_end)
+
+    logical_runway_key: what we use for RUNWAY_STATE (sequencing)
+    runway_end: the textual end we speak in phraseology ("36L", "18L")
+
+    Rules:
+    - If using new-style 'runways' config:
+        * For landing -> only consider runways with non-empty 'landing_ends'
+        * For takeoff -> only consider runways with non-empty 'takeoff_ends'
+        * First matching runway wins (deterministic, no random choice)
+    - If no 'runways' block exists, fall back to old 'landings' / 'departures'.
+    """
+
+    runways_cfg = tower_cfg.get("runways") or []
+
+    # --- New-style config: list of runway dicts ---
+    if runways_cfg and isinstance(runways_cfg[0], dict):
+        for rwy in runways_cfg:
+            if action == "landing":
+                ends = rwy.get("landing_ends") or []
+            elif action == "takeoff":
+                ends = rwy.get("takeoff_ends") or []
+            else:
+                ends = []
+
+            # This runway does NOT handle this operation at all
+            if not ends:
+                continue
+
+            # This runway is valid for this operation -> use it
+            runway_end = ends[0]  # first defined end; deterministic
+            logical_id = rwy.get("physical_id") or rwy.get("id") or runway_end
+            return logical_id, runway_end
+
+    # --- Fallback: old-style config using plain lists ---
+    if action == "landing":
+        choices = tower_cfg.get("landings") or tower_cfg.get("runways", [])
+    elif action == "takeoff":
+        choices = tower_cfg.get("departures") or tower_cfg.get("runways", [])
+    else:
+        choices = tower_cfg.get("runways", [])
+
+    if not choices:
+        return "DEFAULT", ""
+
+    # Old behaviour: first runway in the list
+    runway_end = choices[0]
+    logical_id = runway_end
+    return logical_id, runway_end
+
+def normalize_atc_message(message_text: str, sender_name: str) -> tuple[str | None, str | None, str | None]:
+    """
+    Supports:
+      AIRPORT, CALLSIGN, request ...
+      AIRPORT, request ...
+
+    Returns: (airport_code, callsign, request_text) or (None, None, None)
+    """
+    # Limit splits so commas in the request are preserved
+    parts = [x.strip() for x in message_text.split(",", 2)]
+
+    if len(parts) < 2:
+        return None, None, None
+
+    # Normalize + intern once at ingest: downstream key lookups on
+    # (airport, callsign) then hash/compare interned strings and no
+    # helper needs its own defensive .upper().
+    airport_code = sys.intern(parts[0].upper())
+
+    if len(parts) == 2:
+        # Example: "SLHA, request takeoff."
+        callsign = sys.intern((sender_name or "").upper())
+        request_text = parts[1]
+        return airport_code, callsign, request_text
+
+    # Example: "SLHA, N463R6, request takeoff."
+    callsign = sys.intern((parts[1] or sender_name or "").upper())
+    request_text = parts[2]
+    return airport_code, callsign, request_text
+
+@functools.lru_cache(maxsize=1024)
+def is_flight_plan_request(request_text: str) -> bool:
+    """
+    Minimal flight plan detector based on JSON-configured triggers.
+    """
+    if not request_text:
+        return False
+    if not request_text.islower():
+        request_text = request_text.lower()
+    return bool(_FP_RE and _FP_RE.search(request_text))
+
+def extract_route(text: str, fallback_origin: str):
+    """
+    Returns (origin, destination)
+    """
+    # Both route patterns require one of these separators; most messages
+    # have none, so skip the regex engine entirely for them. Callers pass
+    # already-lowered text, so no extra copy is made here.
+    if not text.islower():
+        text = text.lower()
+    if not (
+        "to" in text or ">" in text or "-" in text or "–" in text
+    ):
+        return fallback_origin.upper(), None
+
+    m = DEST_ONLY_PATTERN.search(text)
+    if m:
+        return fallback_origin.upper(), m.group(1).upper()
+
+    m = ROUTE_PATTERN.search(text)
+    if m:
+        return m.group(1).upper(), m.group(2).upper()
+
+    # 3) Nothing found
+    return fallback_origin.upper(), None
+
+def _render_auto_clear(entry: dict) -> str:
+    """Render the auto-clear text for a queued entry.
+
+    Done once when the entry is queued so the sequencing sweep only has
+    to append the prebuilt text (plus any dispatch-time handoff suffix).
+    """
+    templates = AUTO_CLEAR_RESPONSES.get(entry["action"], [])
+    if templates:
+        return _choice(templates).format(
+            callsign=entry["callsign"],
+            runway=entry["runway"],
+            airport=entry["airport"],
+        )
+    if entry["action"] == "landing":
+        return f"{entry['callsign']}, cleared to land runway {entry['runway']}."
+    return f"{entry['callsign']}, cleared for takeoff runway {entry['runway']}."
+
+def process_runway_sequencing():
+    if not SEQUENCING.get("enabled", False):
+        return
+    if not SEQUENCING.get("auto_clear_next", False):
+        return
+
+    now = current_time()
+
+    # Snapshots: get_runway_state inserts airports/runways from request
+    # threads while this sweep runs on the ticker thread.
+    for airport_code, runways in list(RUNWAY_STATE.items()):
+        for runway, state in list(runways.items()):
+
+            # Expire active runway
+            if state.active and now >= state.expires_at:
+                clear_runway(state)
+
+            # Auto-clear next
+            if not state.active and state.queue:
+                entry = state.queue.popleft()
+
+                occupy = OCCUPANCY.get(entry["action"], 30)
+                set_runway_active(state, entry, occupy)
+
+                text = entry.get("rendered_text") or _render_auto_clear(entry)
+
+                # Flight plan departure handoff for auto-cleared takeoffs
+                if entry["action"] == "takeoff":
+                    key = (entry["airport"], entry["callsign"].upper())
+                    if key in ACTIVE_FLIGHT_PLANS:
+                        ACTIVE_FLIGHT_PLANS.pop(key, None)
+
+                        if FP_HANDOFF_RESPONSES and FP_HANDOFF_CHANCE > 0.0:
+                            if _random() < FP_HANDOFF_CHANCE:
+                                handoff_template = _choice(FP_HANDOFF_RESPONSES)
+                                entry_rt = TOWER_RT.get(entry["airport"])
+                                freq_str = entry_rt.tower_freq_str if entry_rt else format_freq(DEFAULT_FREQUENCY)
+                                handoff_text = handoff_template.format(
+                                    AIRPORT=entry["airport"],
+                                    FREQUENCY=freq_str,
+                                )
+                                text = f"{text} {handoff_text}"
+
+                freq = entry["frequency"]
+                ch = get_channel(freq)
+                if ch:
+                    with ch.lock:
+                        ch.messages.append(
+                            _msg_json(ch.next_id, _cap(text), entry["sender"])
+                        )
+                        ch.next_id += 1
+
+# ---------------------------
+# ATC Bot Logic
+# ---------------------------
+def handle_atc(message_text: str, channel: int, sender_name: str):
+    """
+    Process ATC bot responses.
+    Message format: AIRPORT_CODE, CALLSIGN, request ...
+    """
+    global _HELIPADS_DIRTY
+
+    # --- Parse & normalize (fills callsign if user omitted it) ---
+    airport_code, callsign, request_text = normalize_atc_message(
+        message_text,
+        sender_name,
+    )
+
+    if not airport_code or not request_text:
+        return None
+
+    original_request_text = request_text
+    request_text = request_text.lower()
+
+    # --- Emergency detection ---
+    # 0) Signal-letter prefilter over the whole chain: routine traffic
+    #    contains none of the first letters of any emergency phrase, so
+    #    skip all three detection stages outright for it.
+    emergency_type = EMERGENCY_TYPE_NONE
+    has_emergency = False
+    if _EMERG_PREFILTER_RE is None or _EMERG_PREFILTER_RE.search(request_text):
+        # 1) Type from JSON-defined triggers (mayday / pan / generic)
+        emergency_type = detect_emergency_type(request_text)
+        has_emergency = emergency_type != EMERGENCY_TYPE_NONE
+
+        # 2) Extra safety pass using flattened trigger list
+        if not has_emergency and _EMERG_ANY_RE:
+            if _EMERG_ANY_RE.search(request_text):
+                has_emergency = True
+                emergency_type = EMERGENCY_TYPE_GENERIC
+
+        # 3) Optional "sounds like" fuzziness
+        if not has_emergency and sounds_like_possible_emergency(request_text):
+            has_emergency = True
+            emergency_type = EMERGENCY_TYPE_GENERIC
+
+    is_helicopter = is_helicopter_request(request_text, callsign)
+
+    # parse_requested_runway returns normalized uppercase ("27L") or None;
+    # downstream checks rely on that and must not re-.upper() it.
+    requested_runway = parse_requested_runway(request_text)
+    pilot_key = (airport_code, callsign)
+
+    tower = ATC_TOWERS.get(airport_code)
+    if not tower:
+        return None
+
+    # --- Base frequencies for this airport ---
+    rt = TOWER_RT[airport_code]
+    tower_freq = rt.tower_freq
+    ground_freq = rt.ground_freq
+
+    # --- Classify the request intent ---
+    # Only multi-frequency airports redirect between ground and tower, so
+    # single-frequency fields skip both classification scans on the common
+    # path (the rare wrong-airport branch recomputes them below).
+    if rt.single_freq:
+        is_ground_request = is_tower_request = False
+    else:
+        # Ground ONLY handles taxi / pushback
+        is_ground_request = bool(_GROUND_RE and _GROUND_RE.search(request_text))
+
+        # Tower-style requests (takeoff / landing, you can add more actions)
+        is_tower_request = bool(_TOWER_RE and _TOWER_RE.search(request_text))
+
+    # =========================================================
+    # 1) Redirects: real ground/tower requests on the *wrong* freq
+    # =========================================================
+
+    # A) Ground-style requests (taxi / startup) on TOWER frequency -> redirect to GROUND
+    if (is_ground_request
+        and tower_freq != ground_freq
+        and channel == tower_freq
+    ):
+
+        # Special-case startup redirect if desired
+        is_startup_request = bool(_STARTUP_RE and _STARTUP_RE.search(request_text))
+
+        if is_startup_request:
+            templates = REDIRECT_MESSAGES.get("startup_tower_to_ground", [])
+            # Fall back to generic tower_to_ground if startup-specific empty
+            if not templates:
+                templates = REDIRECT_MESSAGES.get("tower_to_ground", [])
+        else:
+            templates = REDIRECT_MESSAGES.get("tower_to_ground", [])
+
+        if templates:
+            template = _choice(templates)
+            text = template.format(
+                callsign=callsign,
+                airport=airport_code,
+                # These messages talk about CONTACT GROUND on {frequency}
+                frequency=rt.ground_freq_str,
+            )
+            text = _cap(text)
+
+            return text, rt.tower_sender
+
+            # No templates? just ignore like before
+        return None
+
+    # B) Tower-style requests (takeoff / landing) on GROUND frequency -> redirect to TOWER
+    if (
+        is_tower_request
+        and tower_freq != ground_freq
+        and channel == ground_freq
+    ):
+
+        templates = REDIRECT_MESSAGES.get("ground_to_tower", [])
+        if templates:
+            template = _choice(templates)
+            text = template.format(
+                callsign=callsign,
+                airport=airport_code,
+                # These messages talk about CONTACT TOWER on {frequency}
+                frequency=rt.tower_freq_str,
+            )
+            text = _cap(text)
+
+            return text, rt.ground_sender
+
+        return None
+
+    # =========================================================
+    # 2) If the tuned frequency doesn't belong to this airport
+    #    (Emergencies are allowed to bypass this)
+    # =========================================================
+    if channel not in (tower_freq, ground_freq):
+        # For emergencies, treat as if they reached this airport's ATC anyway
+        if has_emergency:
+            # We just continue without redirecting; role will default to Tower.
+            pass
+        else:
+            responses = REDIRECT_MESSAGES.get("wrong_airport_frequency", [])
+            if not responses:
+                return None
+
+            template = _choice(responses)
+            if rt.single_freq:
+                is_ground_request = bool(_GROUND_RE and _GROUND_RE.search(request_text))
+                is_tower_request = bool(_TOWER_RE and _TOWER_RE.search(request_text))
+            is_fp = is_flight_plan_request(request_text)
+
+            # Prefer tower if this handler has tower_freq, otherwise ground
+            if is_tower_request and not is_fp:
+                freq_str = rt.tower_freq_str
+                sender_role = rt.tower_sender
+            elif is_ground_request and not is_fp:
+                freq_str = rt.ground_freq_str
+                sender_role = rt.ground_sender
+            else:
+                return None
+
+            response_text = template.format(
+                CALLSIGN=callsign,
+                REQUESTED_AIRPORT=airport_code,
+                FREQUENCY=freq_str
+            )
+            # Callsigns are uppercased at ingest, so the prefixed text
+            # already starts with a capital — no _cap pass needed.
+            full_text = f"{callsign}, {response_text}"
+            return full_text, sender_role
+
+
+    # =========================================================
+    # 3) Determine role based on the frequency we are actually tuned to
+    # =========================================================
+    if channel == ground_freq and ground_freq != tower_freq:
+        role = "ground"
+        sender_name = rt.ground_sender
+    else:
+        # Default: tower (covers both tower freq and single-frequency airports)
+        role = "tower"
+        sender_name = rt.tower_sender
+
+    # =========================================================
+    # 4) Flight plan handling (simple: store flag, send canned reply)
+    # =========================================================
+    if is_flight_plan_request(request_text):
+        # Mark this callsign as having a flight plan at this airport
+        fp_now = current_time()
+        ACTIVE_FLIGHT_PLANS[pilot_key] = fp_now
+        heapq.heappush(
+            _EXPIRY_HEAP,
+            (fp_now + FLIGHT_PLAN_TTL_SECONDS, _EXPIRY_KIND_FLIGHT_PLAN, pilot_key),
+        )
+
+        origin, destination = extract_route(request_text, airport_code)
+
+        FLIGHT_PLAN_ROUTES[pilot_key] = {
+        "origin": origin,
+        "destination": destination,
+        }
+
+        if destination:
+            usable_templates = FP_RESPONSES
+        else:
+            # Fallback safety: if every template names the destination,
+            # use the full pool rather than go silent.
+            usable_templates = FP_RESPONSES_NO_DEST or FP_RESPONSES
+
+        template = _choice(usable_templates)
+
+        fp_text = template.format(
+            CALLSIGN=callsign,
+            AIRPORT=airport_code,
+            ORIGIN=origin or airport_code,
+            DESTINATION=destination or "",
+        )
+
+        fp_text = _cap(fp_text)
+
+        # Always respond as Tower for flight plans
+        sender_name = tower.get("sender", f"{airport_code} ATC")
+        return fp_text, sender_name
+
+    # =========================================================
+    # 5) Normal ATC trigger matching
+    # =========================================================
+
+    for action, action_re in TRIGGER_ACTION_RES:
+        if action_re.search(request_text):
+
+            helicopter_full_text = False
+
+            effective_action = action
+
+            # If an emergency was declared but we matched some generic/emergency action
+            # (e.g. action == "emergency"), treat it as a landing by default.
+            if has_emergency and effective_action not in ("landing", "takeoff", "taxi"):
+                effective_action = "landing"
+
+            if has_emergency and effective_action == "landing":
+            # Use emergency landing templates from auto_clear if present; fall back to normal landing
+                templates_pool = (
+                    AUTO_CLEAR_RESPONSES.get("emergency_landing_clearance")
+                    or ATC_RESPONSES.get("landing", [])
+                )
+            else:
+                templates_pool = ATC_RESPONSES.get(effective_action, [])
+
+            if not templates_pool:
+                # No templates for this action; move on to next match
+                continue
+
+            template = _choice(templates_pool)
+
+            # --------------------------------------------------
+            # Runway selection (now using JSON runway config)
+            # --------------------------------------------------
+            logical_runway_id = None
+            runway = ""
+            helipad_id = None
+
+            # Helicopter → prefer helipads if defined for this airport
+            if is_helicopter and action in ("landing", "takeoff"):
+                # Did they mention a specific pad in the text?
+                requested_helipad = find_requested_helipad(airport_code, original_request_text)
+
+                # For takeoff: if they didn’t say a pad, try the pad we remembered from landing
+                if action == "takeoff" and not requested_helipad:
+                    remembered_pad = PILOT_ASSIGNED_HELIPAD.get(pilot_key)
+                    if remembered_pad:
+                        requested_helipad = remembered_pad
+
+                helipad_id, helipad_mode = assign_helipad(airport_code, requested_helipad, action)
+
+                if helipad_mode == "hold":
+                    # Multi-pad airport, all pads full
+                    hold_text = f"{callsign}, all helipads are currently occupied, standby."
+                    hold_text = _cap(hold_text)
+                    return hold_text, sender_name
+
+                if helipad_mode == "anywhere":
+                    # Single-pad airport, pad is full -> let them land anywhere
+                    # If we know the pad id, include it for flavor
+                    pad_map = HELIPADS_BY_AIRPORT.get(airport_code, {})
+                    pad_name = None
+                    if pad_map:
+                        # Just grab the first pad id/name if any
+                        only_id = next(iter(pad_map.keys()))
+                        pad_name = only_id
+
+                    if pad_name:
+                        anywhere_text = (
+                            f"{callsign}, helipad {pad_name} is occupied, "
+                            f"cleared to land anywhere on the field."
+                        )
+                    else:
+                        anywhere_text = (
+                            f"{callsign}, helipad is occupied, cleared to land anywhere on the field."
+                        )
+
+                    anywhere_text = _cap(anywhere_text)
+                    return anywhere_text, sender_name
+
+                # If we got a helipad_id, we intentionally do NOT pick a runway
+                if helipad_id:
+                    logical_runway_id = None
+                    runway = ""
+
+            # Fixed-wing runway logic (or helicopters at airports with no helipads)
+            if action in ("landing", "takeoff"):
+                if action == "takeoff":
+                    valid = runway_ends_for_action(tower, "takeoff")
+
+                    # 1) Honor explicit requested runway if valid
+                    if requested_runway and requested_runway in valid:
+                        runway = requested_runway
+                        logical_runway_id = physical_id_for_runway_end(tower, runway)
+                        PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
+
+                    else:
+                        # 2) Reuse taxi-assigned runway if valid
+                        assigned = PILOT_ASSIGNED_RUNWAY.get(pilot_key)
+                        if assigned and assigned in valid:
+                            runway = assigned
+                            logical_runway_id = physical_id_for_runway_end(tower, runway)
+                        else:
+                            # 3) Fall back to existing chooser
+                            logical_runway_id, runway = choose_runway_for_action(tower, action)
+                            if runway:
+                                PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
+
+                else:
+                    # landing:
+                    valid = runway_ends_for_action(tower, "landing")
+
+                    if requested_runway and requested_runway in valid:
+                        runway = requested_runway
+                        logical_runway_id = physical_id_for_runway_end(tower, runway)
+                        PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
+                    else:
+                        logical_runway_id, runway = choose_runway_for_action(tower, action)
+                        if runway:
+                            PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
+
+
+            elif action == "taxi":
+                valid = runway_ends_for_action(tower, "taxi")
+
+                # 1) If pilot explicitly requested a runway and it's valid for taxi → honor it
+                if requested_runway and requested_runway in valid:
+                    runway = requested_runway
+                    PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
+
+                else:
+                    # 2) Reuse previously assigned runway (keeps taxi->takeoff consistent)
+                    assigned = PILOT_ASSIGNED_RUNWAY.get(pilot_key)
+                    if assigned and assigned in valid:
+                        runway = assigned
+                    else:
+                        # 3) Otherwise pick a runway (random or your own strategy)
+                        pool = SORTED_TAXI_ENDS.get(airport_code, ())
+                        runway = _choice(pool) if pool else ""
+                        if runway:
+                            PILOT_ASSIGNED_RUNWAY[pilot_key] = runway
+
+
+            elif action == "startup":
+                # startup does not need a runway
+                logical_runway_id = None
+                runway = ""
+
+            else:
+                # Other actions (non-runway-specific)
+                base_choices = (
+                    tower.get("runways")
+                    or tower.get("landings")
+                    or tower.get("departures")
+                    or []
+                )
+                runway = base_choices[0] if base_choices else ""
+
+            # --------------------------------------------------
+            # Emergency bookkeeping: record which runway we gave them
+            # --------------------------------------------------
+            if has_emergency and action == "landing" and runway:
+                record_emergency(airport_code, callsign, emergency_type, runway)
+
+                            # --------------------------------------------------
+            # Runway sequencing (landing / takeoff only)
+            # Emergencies are allowed to override existing occupancy.
+            # --------------------------------------------------
+            if (
+                SEQUENCING.get("enabled", True)
+                and role == "tower"
+                and action in ("landing", "takeoff")
+                and not is_helicopter
+            ):
+                # Group by physical runway when using new config;
+                # fall back to using the runway end string otherwise.
+                runway_key = logical_runway_id or runway or "DEFAULT"
+                state = get_runway_state(airport_code, runway_key)
+
+                if has_emergency and action == "landing":
+                    occupy = OCCUPANCY.get("emergency_landing", OCCUPANCY.get(action, 60))
+                else:
+                    occupy = OCCUPANCY.get(action, 30)
+
+                entry = {
+                    "airport": airport_code,
+                    "runway": runway,    # end used in messages
+                    "callsign": callsign,
+                    "action": action,
+                    "frequency": channel,
+                    "sender": sender_name,
+                    "emergency": has_emergency,
+                }
+
+                # Check if there's already an active aircraft and whether it's an emergency
+                active = state.active
+                active_is_emergency = bool(active and active.get("emergency"))
+
+                if runway_active(state):
+
+                    if not has_emergency:
+                        # ---- NORMAL TRAFFIC WHILE RUNWAY IS BUSY ----
+                        # Always queue normal traffic so process_runway_sequencing()
+                        # can auto-clear it later.
+                        entry["rendered_text"] = _render_auto_clear(entry)
+                        state.queue.append(entry)
+
+                        position = len(state.queue) + 1
+
+                        # If the *current* active aircraft is an emergency, prefer the
+                        # spial emergency-hold messages, otherwise normal hold text.
+                        if active_is_emergency:
+                            # --- NEW: hold normal traffic due to active emergency ---
+                            hold_templates = _HOLD_EMERG or HOLD_MESSAGES.get(action, [])
+
+                        else:
+                            hold_templates = HOLD_MESSAGES.get(action, [])
+
+                        if hold_templates:
+                            hold_template = _choice(hold_templates)
+                            # You can include emergency runway / callsign in the message later
+                            hold_text = hold_template.format(
+                                callsign=callsign,
+                                runway=runway,
+                                position=position,
+                            )
+                        else:
+                            if active_is_emergency:
+                                hold_text = (
+                                    f"{callsign}, hold, runway blocked due to "
+                                    f"emergency traffic."
+                                )
+                            else:
+                                hold_text = f"{callsign}, hold, traffic in sequence."
+
+                        hold_text = _cap(hold_text)
+                        return hold_text, sender_name
+
+                    if active and not active_is_emergency:
+                        active["rendered_text"] = _render_auto_clear(active)
+                        state.queue.append(active)
+
+                # Either runway is free OR this is an emergency:
+                # mark it active for this aircraft (emergency overrides whoever was there).
+                set_runway_active(state, entry, occupy)
+
+
+            # --------------------------------------------------
+            # If pilot requested an invalid runway, override with
+            # a friendly "unable, use {runway}" style message
+            # --------------------------------------------------
+            # --------------------------------------------------
+            # Invalid runway request handling (JSON-driven)
+            # --------------------------------------------------
+            if action in ("landing", "takeoff") and requested_runway and not is_helicopter:
+                # Reuse `valid` computed above for this action instead of
+                # re-entering runway_ends_for_action, and skip all the
+                # formatting work when no templates are configured.
+                templates = INVALID_RUNWAY_MESSAGES.get(action, [])
+
+                if templates and runway and requested_runway not in valid:
+                    template = _choice(templates)
+                    invalid_text = template.format(
+                        callsign=callsign,
+                        requested=requested_runway,
+                        runway=runway,
+                    )
+                    invalid_text = _cap(invalid_text)
+                    return invalid_text, sender_name
+
+            # --- Build response text with runway/taxiway placeholders ---
+            if "taxiway" in template.fields and "taxiways" in tower:
+                taxiway = _choice(tower["taxiways"])
+                response_text = template.format(
+                    landings=runway,
+                    departures=runway,
+                    taxiway=taxiway,
+                )
+            else:
+                response_text = template.format(
+                    callsign=callsign,
+                    landings=runway,
+                    departures=runway,
+                )
+
+            # --- Helicopter-specific phrasing (JSON-driven) ---
+            # For helicopters requesting takeoff/landing, switch to helicopter_* responses.
+            if is_helicopter and effective_action in ("takeoff", "landing"):
+                heli_text = choose_helicopter_response(airport_code, effective_action, callsign, helipad=helipad_id)
+                if heli_text:
+                    response_text = heli_text
+                    helicopter_full_text = True
+
+            # --- Ground → Tower handoff (only when actually on Ground) ---
+            if role == "ground" and action == "taxi":
+                if tower_freq != ground_freq:
+                    if _random() < 0.8:  # 80% chance
+                        handoffs = HANDOFF_MESSAGES.get("ground_to_tower", [])
+                        if handoffs:
+                            handoff_template = _choice(handoffs)
+                            formatted_freq = rt.tower_freq_str
+                            handoff_text = handoff_template.format(
+                                airport=airport_code,
+                                frequency=formatted_freq,
+                            )
+                            response_text = f"{response_text}, {handoff_text}"
+
+            # --- Flight plan departure handoff (Tower, takeoff only) ---
+            if action == "takeoff" and role == "tower":
+                key = pilot_key
+                route_info = FLIGHT_PLAN_ROUTES.pop(key, None)
+
+                if key in ACTIVE_FLIGHT_PLANS:
+                    # Drop the plan as soon as we issue a takeoff clearance
+                    ACTIVE_FLIGHT_PLANS.pop(key, None)
+
+                    if FP_HANDOFF_RESPONSES and FP_HANDOFF_CHANCE > 0.0:
+                        if _random() < FP_HANDOFF_CHANCE:
+                            handoff_template = _choice(FP_HANDOFF_RESPONSES)
+                            # Default: handoff is back to the *current* airport tower
+                            handoff_airport = airport_code
+                            handoff_freq = rt.tower_freq
+
+                            # If we have a destination from the flight plan, try to hand off there instead
+                            dest_icao = None
+                            if route_info:
+                                dest_icao = route_info.get("destination")
+
+                            if dest_icao:
+                                dest_rt = TOWER_RT.get(dest_icao.upper())
+                                if dest_rt:
+                                    dest_freq = dest_rt.tower_freq
+                                    if dest_freq:
+                                        handoff_airport = dest_icao.upper()
+                                        handoff_freq = dest_freq
+
+                            freq_str = format_freq(handoff_freq)
+
+                            # Allow templates to use AIRPORT and/or DESTINATION for the handoff airport
+                            handoff_text = handoff_template.format(
+                                AIRPORT=handoff_airport,
+                                DESTINATION=handoff_airport,
+                                FREQUENCY=freq_str,
+                            )
+                            response_text = f"{response_text}, {handoff_text}"
+
+            # --- Emergency acknowledgements and traffic hold calls ---
+            if has_emergency and role == "tower" and action == "landing":
+                # 1) Pick the right ack family
+                if emergency_type == EMERGENCY_TYPE_MAYDAY:
+                    ack_pool = _ACK_MAYDAY
+                elif emergency_type == EMERGENCY_TYPE_PAN:
+                    ack_pool = _ACK_PAN
+                else:
+                    ack_pool = _ACK_GENERIC
+
+                if ack_pool:
+                    ack_template = _choice(ack_pool)
+                    ack_text = ack_template.format(
+                        CALLSIGN=callsign,
+                        AIRPORT=airport_code,
+                    )
+                else:
+                    ack_text = f"{callsign}, roger, emergency acknowledged."
+
+                # 2) Optional broadcast-style traffic hold message
+                emergency_hold_pool = _HOLD_EMERG
+                hold_broadcast = ""
+                if emergency_hold_pool and _random() < 0.6:
+                    hold_broadcast = " " + _choice(emergency_hold_pool).raw
+
+                # Stick ack in front, broadcast at the end; one BUILD_STRING
+                # per branch, no trailing space to strip afterwards.
+                if response_text:
+                    response_text = f"{ack_text} {response_text}{hold_broadcast}"
+                else:
+                    response_text = f"{ack_text}{hold_broadcast}"
+
+
+            # --- Helipad occupancy bookkeeping ---
+                            # --- Helipad bookkeeping (pilot assignment only; occupancy is derived) ---
+            now_ts = current_time()
+
+            if is_helicopter and helipad_id and action == "landing":
+                # Remember which pad this pilot is on
+                PILOT_ASSIGNED_HELIPAD[pilot_key] = helipad_id
+                PILOT_HELIPAD_LAST_ACTIVITY[pilot_key] = now_ts
+                heapq.heappush(
+                    _EXPIRY_HEAP,
+                    (now_ts + HELIPAD_TTL_SECONDS, _EXPIRY_KIND_HELIPAD, pilot_key),
+                )
+                _HELIPADS_DIRTY = True
+
+            if is_helicopter and action == "takeoff":
+                # Pilot is leaving; drop their pad assignment
+                if pilot_key in PILOT_ASSIGNED_HELIPAD:
+                    PILOT_ASSIGNED_HELIPAD.pop(pilot_key, None)
+                    _HELIPADS_DIRTY = True
+                PILOT_HELIPAD_LAST_ACTIVITY.pop(pilot_key, None)
+
+
+            if helicopter_full_text:
+                # Helicopter templates already include the callsign but
+                # may phrase around it, so keep the capitalize guard.
+                full_text = _cap(response_text)
+            else:
+                # Uppercased-at-ingest callsign prefix: already capital.
+                full_text = f"{callsign}, {response_text}"
+
+            # Use per-role sender_name (Tower / Ground)
+            return full_text, sender_name
+
+    # =========================================================
+    # 5b) Emergency fallback: emergency but no action matched
+    # =========================================================
+    if has_emergency:
+        if emergency_type == EMERGENCY_TYPE_MAYDAY:
+            ack_pool = _ACK_MAYDAY
+        elif emergency_type == EMERGENCY_TYPE_PAN:
+            ack_pool = _ACK_PAN
+        else:
+            ack_pool = _ACK_GENERIC
+
+        if ack_pool:
+            ack_template = _choice(ack_pool)
+            ack_text = ack_template.format(
+                CALLSIGN=callsign,
+                AIRPORT=airport_code,
+            )
+        else:
+            ack_text = f"{callsign}, roger, emergency acknowledged."
+
+        ack_text = _cap(ack_text)
+        return ack_text, sender_name
+
+    # =========================================================
+    # 5c) Fallback: unknown / unrecognized request on a valid freq
+    # =========================================================
+    templates = UNKNOWN_MESSAGES.get(role) or UNKNOWN_MESSAGES.get("default", [])
+    if templates:
+        template = _choice(templates)
+        unknown_text = template.format(
+            callsign=callsign,
+            airport=airport_code,
+        )
+        unknown_text = _cap(unknown_text)
+
+        return unknown_text, sender_name
+
+    # No unknown templates defined, behave like original: silent
+    return None
+
+# (airport, role) -> (weather version, METAR minute, body bytes, etag)
+_LOOKUP_CACHE: dict[tuple[str, str], tuple[int, int, bytes, str]] = {}
+
+def _etag_response(body: bytes, etag: str, max_age: int):
+    """
+    Serve prebuilt JSON bytes with Cache-Control + ETag so polling
+    clients can revalidate cheaply (304 with no body when unchanged).
+    """
+    if request.headers.get("If-None-Match") == etag:
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(body, mimetype="application/json")
+
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return resp
+
+def _json(obj, status: int = 200):
+    """
+    Serialize with stdlib json directly into a Response, skipping
+    jsonify's provider indirection. orjson would be faster still, but
+    it is not a dependency and these payloads are small.
+    """
+    return app.response_class(
+        json.dumps(obj, separators=(",", ":")),
+        status=status,
+        mimetype="application/json",
+    )
+
+def cacheable_json_response(payload: dict, max_age: int):
+    body = json.dumps(payload).encode("utf-8")
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return _etag_response(body, etag, max_age)
+
+@app.route("/")
+def index():
+    return _json({
+        "status": "online",
+        "instance_id": SERVER_INSTANCE_ID,
+        "active_frequencies": len(channels)
+    })
+
+@app.route("/atc/lookup", methods=["GET"])
+def atc_lookup():
+    airport = request.args.get("airport", "").upper()
+    role = request.args.get("role", "tower").lower()
+    if role != "ground":
+        role = "tower"  # anything else falls back to tower, as before
+
+    tower = ATC_TOWERS.get(airport)
+    if not tower:
+        return _json({"error": "unknown airport"}, 404)
+
+    state = get_weather_for_airport(airport)
+
+    # Serialized-body cache: content only changes when the weather sim
+    # version or the METAR minute moves, so hits skip payload build,
+    # json.dumps and the ETag hash entirely.
+    ver = state.get("version", 0) if state else -1
+    minute = int(current_time()) // 60
+    cache_key = (airport, role)
+    cached = _LOOKUP_CACHE.get(cache_key)
+    if cached is not None and cached[0] == ver and cached[1] == minute:
+        return _etag_response(cached[2], cached[3], max_age=60)
+
+    rt = TOWER_RT[airport]
+    if role == "ground":
+        freq, sender = rt.ground_freq, rt.ground_sender
+    else:
+        freq, sender = rt.tower_freq, rt.tower_sender
+
+    metar = None
+    if state:
+        metar_body = metar_for_airport(airport, state)
+        if metar_body:
+            metar = f"METAR {metar_body}"
+
+    body = json.dumps({
+        "airport": airport,
+        "frequency": freq,
+        "sender": sender,
+        "metar": metar
+    }).encode("utf-8")
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    _LOOKUP_CACHE[cache_key] = (ver, minute, body, etag)
+    return _etag_response(body, etag, max_age=60)
+
+@app.route("/state", methods=["GET"])
+def get_state():
+    freq = int(request.args.get("frequency", 16))
+
+    channel = channels.get(freq)
+    last_id = channel.next_id - 1 if channel is not None else 0
+
+    # The payload is a pure function of last_id, so polls on an idle
+    # channel revalidate with a body-less 304 instead of re-serializing.
+    etag = f"{freq}-{last_id}"
+    if request.headers.get("If-None-Match") == etag:
+        resp = app.response_class(status=304)
+    else:
+        resp = _json({
+            "frequency": freq,
+            "last_id": last_id
+        })
+    resp.headers["ETag"] = etag
+    return resp
+
+def _send_one(data: dict) -> tuple[dict, int]:
+    """
+    Core of /send for a single message dict: permission check, append,
+    ATC handling. Returns (payload, http_status) so /send and /send_batch
+    share one code path.
+    """
+    freq = int(data.get("frequency", 16))
+    text = data.get("text", "").strip()
+    sender = data.get("sender", "UNKNOWN")
+    sender_uuid = data.get("sender_uuid")
+
+    # json.dumps of the payload is only worth doing when INFO actually
+    # gets emitted; at WARN and above this whole block is one level check.
+    if app.logger.isEnabledFor(logging.INFO):
+        app.logger.info(
+            "[RX /send] freq=%r sender=%r text=%r full_json=%s",
+            freq,
+            sender,
+            text,
+            json.dumps(data, ensure_ascii=False)
+        )
+
+    if not text:
+        return {"error": "empty message"}, 400
+
+     # --- Dedicated-channel TX permission check (GNN, etc.) ---
+    if not can_transmit_on_frequency(freq, sender_uuid):
+        return {
+            "status": "blocked",
+            "error": "TX_NOT_ALLOWED",
+            "reason": "CHANNEL_RECV_ONLY"
+        }, 403
+
+    channel = get_channel(freq)
+
+    with channel.lock:
+        msg_id = channel.next_id
+        channel.messages.append(_msg_json(msg_id, text, sender))
+        channel.next_id += 1
+
+        atc_response = handle_atc(text, freq, sender)
+        if atc_response:
+            atc_text, atc_sender = atc_response
+            channel.messages.append(
+                _msg_json(channel.next_id, atc_text, atc_sender)
+            )
+            channel.next_id += 1
+
+    return {
+        "status": "sent",
+        "id": msg_id
+    }, 200
+
+@app.route("/send", methods=["POST"])
+def send_message():
+    # Parse the raw body ourselves with cache=False so Flask does not
+    # keep the request bytes alive after the parse.
+    try:
+        data = json.loads(request.get_data(cache=False))
+    except ValueError:
+        return _json({"error": "invalid JSON"}, 400)
+
+    if not isinstance(data, dict):
+        return _json({"error": "invalid JSON"}, 400)
+
+    payload, status = _send_one(data)
+    return _json(payload, status)
+
+
+@app.route("/send_batch", methods=["POST"])
+def send_batch():
+    """
+    Accept {"messages": [<same shape as /send body>, ...]} and process
+    them in order, amortizing routing and JSON parse across the burst.
+    Always returns 200 with a per-message results list.
+    """
+    try:
+        data = json.loads(request.get_data(cache=False))
+    except ValueError:
+        return _json({"error": "invalid JSON"}, 400)
+
+    if not isinstance(data, dict) or not isinstance(data.get("messages"), list):
+        return _json({"error": "invalid JSON"}, 400)
+
+    results = []
+    for entry in data["messages"]:
+        if not isinstance(entry, dict):
+            results.append({"error": "invalid JSON", "http_status": 400})
+            continue
+        payload, status = _send_one(entry)
+        if status != 200:
+            payload["http_status"] = status
+        results.append(payload)
+
+    return _json({"results": results})
+
+
+@app.route("/fetch", methods=["GET"])
+def fetch_messages():
+    freq = int(request.args.get("frequency", 16))
+    since_id = int(request.args.get("since_id", 0))
+
+    if app.logger.isEnabledFor(logging.INFO):
+        app.logger.info(
+            "[RX /fetch] freq=%r since=%r query=%r",
+            freq,
+            since_id,
+            dict(request.args)
+        )
+
+    if freq not in channels:
+        return _json({
+            "instance_id": SERVER_INSTANCE_ID,
+            "messages": []
+        })
+
+    channel = get_channel(freq)
+
+    # The reply depends on (instance, channel epoch, newest id,
+    # since_id), so the ETag carries all four; an idle poll then
+    # collapses to a body-less 304. Ids restart at 1 both across server
+    # restarts (instance prefix) and when an expired frequency is
+    # recreated within one instance (channel epoch); without either, a
+    # coinciding newest id would 304 away entirely different messages.
+    etag = f"{SERVER_INSTANCE_ID}-{channel.epoch}-{channel.next_id - 1}-{since_id}"
+    if request.headers.get("If-None-Match") == etag:
+        resp = app.response_class(status=304)
+        resp.headers["ETag"] = etag
+        return resp
+
+    # IDs are contiguous and ascending (next_id - 1 is the newest), so the
+    # number of messages newer than since_id is pure arithmetic — no need
+    # to test every retained message on each poll.
+    with channel.lock:
+        buf = channel.messages
+        n = len(buf)
+        newer = channel.next_id - 1 - since_id
+        if newer <= 0:
+            msgs = []
+        elif newer >= n:
+            msgs = list(buf)
+        else:
+            msgs = list(islice(buf, n - newer, n))
+
+    # Messages are stored pre-serialized; the body is pure concatenation.
+    body = f'{{"instance_id":{_INSTANCE_ID_JSON},"messages":[{",".join(msgs)}]}}'
+    resp = app.response_class(body, mimetype="application/json")
+    resp.headers["ETag"] = etag
+    return resp
+
+@app.route("/weather", methods=["POST"])
+def get_weather():
+    """
+    Return simulated weather for a given airport.
+
+    Request JSON:
+      { "airport": "SLHA" }
+
+    Response JSON (200):
+      {
+        "ok": true,
+        "airport": "SLHA",
+        "zone": "NORTH_COAST",
+        "condition": "FEW",
+        "visibility": "GOOD",
+        "style": "VFR",
+        "wind_dir": 190,
+        "wind_speed": 8,
+        "temp": 18,
+        "qnh": 1015,
+        "report": "SLHA weather: winds 190 at 8 knots, visibility good, few clouds, temperature 18°C, QNH 1015, flight conditions VFR."
+      }
+    """
+    try:
+        data = json.loads(request.get_data(cache=False))
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+
+    icao = data.get("airport", "").upper().strip()
+
+    if not icao:
+        return _json({"ok": False, "error": "Missing 'airport' field"}, 400)
+
+    state = get_weather_for_airport(icao)
+    if not state:
+        return _json({"ok": False, "error": f"Unknown airport '{icao}'"}, 404)
+
+    report = weather_report_for_airport(icao, state)
+
+    return cacheable_json_response({
+        "ok": True,
+        "airport": icao,
+        **{k: state.get(k) for k in _WEATHER_KEYS},
+        "report": report
+    }, max_age=30)
+
+
+_SIM_TICK_SECONDS = 1.0
+
+def _sim_tick_loop():
+    """
+    Background ticker: channel/TTL housekeeping, runway auto-clear and
+    the weather sim all advance here instead of on every request, so
+    /send and /fetch only do their own work. Each routine keeps its own
+    cheap "nothing due yet" guard, so a 1 s cadence costs almost nothing.
+    """
+    while True:
+        time.sleep(_SIM_TICK_SECONDS)
+        try:
+            housekeeping()
+            process_runway_sequencing()
+            update_all_weather()
+        except Exception:
+            app.logger.exception("sim tick failed")
+
+threading.Thread(target=_sim_tick_loop, name="sim-tick", daemon=True).start()
+
+
+if __name__ == "__main__":
+    # Dev fallback only. In production run under gunicorn (already in
+    # requirements.txt) with a threaded worker so slow clients don't
+    # serialize the whole server behind one connection, e.g.:
+    #   gunicorn -k gthread --threads 8 --workers 1 SpectreNet:app
+    # Keep workers=1: channel/runway/weather state lives in-process.
+    app.run(host="0.0.0.0", port=10000, threaded=True)
\ No newline at end of file